@@ -89,6 +89,16 @@ Open an issue if you find any acronyms I haven't expanded out here!
 
 from math import e, pi
 from .dbg import *
+from .instrument import stage
+from .ingest import DecimatedSource
+from scipy.signal import lfilter
+from numpy.lib.stride_tricks import sliding_window_view
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from scipy.sparse import csr_matrix
+import numpy as np
+import hashlib
+import os
 
 
 
@@ -100,6 +110,173 @@ SMA_WINDOW = 3200
 SAMPLE_RATE = 48000
 MAGNITUDE_MAX = 32767
 
+# Number of samples an SDFTBank advances in one vectorized step, small enough
+# for a block of every key's state to stay in cache
+BLOCK_SIZE = 1024
+
+# Frames evaluated per chunk by the frame-wise engines, bounds how much audio
+# and how large a frame matrix is held at once
+FRAME_CHUNK = 256
+
+# Decimation keeps the highest analyzed key below DECIMATION_MARGIN times the
+# new Nyquist frequency, leaving room for the anti-aliasing filter's roll off
+DECIMATION_MARGIN = 0.8
+
+# Where bin plans are persisted between runs
+BIN_PLAN_DIR = 'media/cache/bin_plans'
+
+
+###############
+## Bin Plans ##
+###############
+
+def search_N_k(note_frequencies, sample_rate, play_rate = PLAY_RATE):
+  '''
+  Vectorized version of the window size search in SDFTBin.find_N_k, for
+  several frequencies at once
+
+  ### Returns
+  - N : The window size of every frequency
+  - error : The distance between every frequency and its closest bin below
+  '''
+  N_i = np.arange(1, sample_rate // play_rate)
+  f_r = sample_rate / N_i
+  errors = np.mod(np.asarray(note_frequencies, dtype=float)[:, None], f_r)
+  # argmin keeps the first (smallest) N on ties, like the original search
+  best = np.argmin(errors, axis=1)
+  return N_i[best], errors[np.arange(len(best)), best]
+
+
+class BinPlan:
+  '''
+  The (N, k, effective frequency, error) of every key for a given sample rate,
+  play rate and key frequency table.
+
+  - effective_frequency : The bin the window size search settled on, the key
+    frequency minus error, its distance to the closest multiple of
+    sample_rate / N below it
+  - effective_bandwidth : sample_rate // N, floored to whole Hz like the
+    original search
+  - k : effective_frequency // effective_bandwidth, the bin actually
+    analyzed. The floored bandwidth can push it past the searched bin, so
+    the analyzed frequency is bin_frequency, not effective_frequency (e.g
+    2935.9 Hz instead of 2793.8 Hz for key 80 at 48 kHz)
+
+  Use BinPlan.get, which memoizes plans in-process and persists them under
+  BIN_PLAN_DIR, so the window size search only ever runs once per setup.
+  '''
+
+  plans = {}
+
+  def __init__(self, note_frequencies, sample_rate, play_rate = PLAY_RATE):
+    self.note_frequencies = np.asarray(note_frequencies, dtype=float)
+    self.sample_rate = sample_rate
+    self.play_rate = play_rate
+    self.N_max = sample_rate // play_rate
+    self.N, self.error = search_N_k(self.note_frequencies, sample_rate, play_rate)
+    self.derive()
+
+  def derive(self):
+    '''Fills in everything that follows from N and the error'''
+    self.effective_frequency = self.note_frequencies - self.error
+    self.effective_bandwidth = self.sample_rate // self.N
+    self.k = (self.effective_frequency // self.effective_bandwidth).astype(np.int64)
+
+  @staticmethod
+  def key(note_frequencies, sample_rate, play_rate):
+    h = hashlib.sha1(f'{sample_rate}:{play_rate}:'.encode())
+    h.update(np.asarray(note_frequencies, dtype=float).tobytes())
+    return h.hexdigest()
+
+  @classmethod
+  def get(cls, note_frequencies, sample_rate, play_rate = PLAY_RATE):
+    '''Returns the plan for this setup, computing and saving it if needed'''
+    key = cls.key(note_frequencies, sample_rate, play_rate)
+    if key in cls.plans:
+      return cls.plans[key]
+
+    path = os.path.join(BIN_PLAN_DIR, f'{key}.npz')
+    plan = cls.load(path, note_frequencies, sample_rate, play_rate)
+    if plan is None:
+      dbg_print(f'Computing bin plan {key}...')
+      plan = cls(note_frequencies, sample_rate, play_rate)
+      plan.save(path)
+
+    cls.plans[key] = plan
+    return plan
+
+  @classmethod
+  def load(cls, path, note_frequencies, sample_rate, play_rate):
+    '''Returns the plan stored at path, or None if it is missing or stale'''
+    try:
+      with np.load(path) as data:
+        N, error = data['N'], data['error']
+    except (OSError, KeyError, ValueError):
+      return None
+    if len(N) != len(note_frequencies):
+      return None
+
+    plan = cls.__new__(cls)
+    plan.note_frequencies = np.asarray(note_frequencies, dtype=float)
+    plan.sample_rate = sample_rate
+    plan.play_rate = play_rate
+    plan.N_max = sample_rate // play_rate
+    plan.N, plan.error = N, error
+    plan.derive()
+    return plan
+
+  def save(self, path):
+    '''Persists N and the error, a missing or read-only cache is not an error'''
+    try:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+      np.savez(tmp_path, N=self.N, error=self.error)
+      os.replace(tmp_path, path)
+    except OSError as err:
+      dbg_print(f'Could not save bin plan to {path}: {err}')
+
+  def decimated(self, q):
+    '''
+    Returns this plan for the audio decimated by q. Every key keeps its k and
+    its window length in seconds (N / q samples, rounded), so its bin sits at
+    the same frequency and sums the same stretch of audio as at the original
+    rate. Searching the new rate from scratch picks unrelated windows instead,
+    which changes every key's magnitude. effective_frequency and error stay
+    those of the search at the original rate.
+    '''
+    plan = BinPlan.__new__(BinPlan)
+    plan.note_frequencies = self.note_frequencies
+    plan.sample_rate = self.sample_rate // q
+    plan.play_rate = self.play_rate
+    plan.N_max = plan.sample_rate // plan.play_rate
+    plan.N = np.maximum(1, np.round(self.N / q)).astype(self.N.dtype)
+    plan.k = self.k
+    plan.effective_frequency = self.effective_frequency
+    plan.effective_bandwidth = plan.sample_rate // plan.N
+    plan.error = self.error
+    return plan
+
+  def take(self, keys):
+    '''Returns the plan of a subset of the keys'''
+    plan = BinPlan.__new__(BinPlan)
+    plan.__dict__.update(self.__dict__)
+    for name in ('note_frequencies', 'N', 'k', 'effective_frequency',
+                 'effective_bandwidth', 'error'):
+      setattr(plan, name, np.asarray(getattr(self, name))[keys])
+    return plan
+
+  @property
+  def bin_frequency(self):
+    '''The center frequency of every key's analyzed bin, k * sample_rate / N'''
+    return self.k * self.sample_rate / self.N
+
+  def __len__(self):
+    return len(self.N)
+
+  def __getitem__(self, i):
+    return (int(self.N[i]), int(self.k[i]), float(self.effective_frequency[i]),
+            float(self.error[i]))
+
 
 ########################################
 ## Sliding Discrete Fourier Transform ##
@@ -107,19 +284,32 @@ MAGNITUDE_MAX = 32767
 
 class SDFTBin:
 
-  def __init__(self, note_frequency, sample_rate, play_rate = PLAY_RATE):
-    dbg_print(f'Creating SDTF Bin at {note_frequency}Hz...')
+  def __init__(self, note_frequency, sample_rate, play_rate = PLAY_RATE, plan = None,
+               sma_window = SMA_WINDOW):
+    '''
+    ### Parameters
+    - plan : Optional (N, k, effective frequency, error) entry of a BinPlan,
+      N and k are searched for when it's missing
+    - sma_window : Samples averaged by both moving averages
+    '''
+    if DEBUG:
+      dbg_print(f'Creating SDTF Bin at {note_frequency}Hz...')
     self.note_frequency = note_frequency
     self.sample_rate = sample_rate
     self.play_rate = play_rate
-    self.find_N_k()
+    if plan is None:
+      self.find_N_k()
+    else:
+      self.set_N_k(*plan)
     self.w = [0 for i in range(self.N)]
     self.X_k = 0
     self.n = 0
-    self.X_k_MA = MovingAverage()
-    self.x_n_MA = MovingAverage()
-    dbg_print(f'Done. Max window size is {self.N_max}')
-    dbg_print("----------------------------------------")
+    self.sma_window = sma_window
+    self.X_k_MA = MovingAverage(sma_window)
+    self.x_n_MA = MovingAverage(sma_window)
+    if DEBUG:
+      dbg_print(f'Done. Max window size is {self.N_max}')
+      dbg_print("----------------------------------------")
 
   def find_N_k(self):
     '''Returns the smallest window size N that returns a frequency resoultion
@@ -128,28 +318,25 @@ class SDFTBin:
       Returns
       - N : The window size
       - k : The index within the frequency bin that we're interested in'''
-    dbg_print(f'Finding N and k for {self.note_frequency}Hz...')
-
-    self.N_max = self.sample_rate // self.play_rate
+    if DEBUG:
+      dbg_print(f'Finding N and k for {self.note_frequency}Hz...')
 
-    N_min = float('inf')
-    error_min = float('inf')
-    for N_i in range(1, self.N_max):
-      f_r = self.sample_rate / N_i
-      error = self.note_frequency % f_r
-      if error < error_min:
-        N_min = N_i
-        error_min = error
+    N, error = search_N_k([self.note_frequency], self.sample_rate, self.play_rate)
+    effective_frequency = self.note_frequency - error[0]
+    k = int(effective_frequency // (self.sample_rate // N[0]))
+    self.set_N_k(N[0], k, effective_frequency, error[0])
 
-    self.N = N_min
-    self.effective_error = error_min
-
-    self.effective_frequency = self.note_frequency - (error_min)
+  def set_N_k(self, N, k, effective_frequency, error):
+    '''Sets the window size and bin index found by find_N_k or a BinPlan'''
+    self.N_max = self.sample_rate // self.play_rate
+    self.N = int(N)
+    self.k = int(k)
+    self.effective_error = float(error)
+    self.effective_frequency = float(effective_frequency)
     self.effective_bandwidth = self.sample_rate // self.N
-
-    self.k = int(self.effective_frequency // self.effective_bandwidth)
-    dbg_assert(self.k < self.N)
-    dbg_print(f'Done! Found N = {self.N} and k = {self.k}')
+    if DEBUG:
+      dbg_assert(self.k < self.N)
+      dbg_print(f'Done! Found N = {self.N} and k = {self.k}')
 
   def update_x_n(self, prev_X_k, curr_X_k, bottom_window_sample):
     '''
@@ -205,6 +392,35 @@ class SDFTBin:
     # dbg_print(f'Done! With a play rate of {self.play_rate}, we expect an output of size {len(x) // self.N_max}, and got {len(X_k)-1}')    
     return X_k, x_n
 
+  def parse_block(self, x):
+    '''
+    Offline version of parse, computed over the whole array at once.
+
+    Eq. (1) is a comb filter (x[n] - x[n-N]) followed by a one-pole resonator
+    with its pole at W = e^((j2pi k)/N), and the SMA is a boxcar, so X_k for
+    every sample comes out of a single lfilter call and the SMAs out of a
+    cumulative sum.
+
+    Returns the same X_k and x_n frames as parse on a freshly created bin, and
+    leaves this bin's sliding state untouched.
+    '''
+    x = np.asarray(x, dtype=float)
+    if len(x) == 0:
+      return np.zeros(0, dtype=complex), np.zeros(0, dtype=complex)
+
+    # Comb filter, then the resonator
+    W = e**((1j * 2*pi * self.k)/self.N)
+    bottom = np.concatenate((np.zeros(min(self.N, len(x))), x[:-self.N]))
+    X_k = lfilter([W], [1, -W], x - bottom)
+
+    # x[n] from consecutive X_k, see update_x_n
+    prev_X_k = np.concatenate(([0], X_k[:-1]))
+    x_n = (X_k * (e**(-1j * 2*pi * (self.k / self.N)))) - prev_X_k + bottom
+
+    frames = np.arange(0, len(x), self.N_max)
+    return (boxcar_at(X_k, frames, self.sma_window),
+            boxcar_at(x_n, frames, self.sma_window))
+
 
 ####################
 ## Moving Average ##
@@ -225,3 +441,551 @@ class MovingAverage:
     self.W.pop(0)
     self.W.append(new_val)
 
+
+
+###################################
+## Vectorized Bank of SDFT Bins  ##
+###################################
+
+class SDFTBank:
+  '''
+  A bank of SDFT bins, one per key, advanced together.
+
+  Keeps X_k, the twiddle factor, the window state and both moving averages of
+  every key in arrays, so each block of samples is processed with a handful of
+  NumPy operations instead of one Python loop per key. Produces the same X_k
+  and x[n] frames as calling SDFTBin.parse on every key.
+
+  Within a block, Eq. (1) is unrolled as
+
+  X_k(n) = W^(n+1) * [X_k(n0-1) W^(-n0) + sum_{m=n0}^{n} (x[m] - x[m-N]) W^(-m)]
+
+  where W = e^((j2pi k)/N). Since W^N = 1, the powers of W are looked up from
+  a table of N phasors per key instead of being recomputed.
+
+  With dtype=np.complex64 all state is kept in single precision, halving its
+  memory. Rounding errors then pile up in X_k (what is added with x[n] is not
+  exactly what is removed with x[n-N]), so X_k is recomputed exactly from the
+  window buffer every resync samples.
+  '''
+
+  def __init__(self, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+               sma_window = SMA_WINDOW, block_size = BLOCK_SIZE,
+               dtype = np.complex128, resync = None, plan = None):
+    '''
+    ### Parameters
+    - plan : BinPlan to use instead of BinPlan.get's
+    - dtype : np.complex128, or np.complex64 for single precision state
+    - resync : Samples between exact recomputations of X_k, defaults to once a
+      second in single precision and never in double precision
+    '''
+    dbg_print(f'Creating SDFT Bank with {len(note_frequencies)} bins...')
+    if plan is None:
+      plan = BinPlan.get(note_frequencies, sample_rate, play_rate)
+
+    self.note_frequencies = list(note_frequencies)
+    self.sample_rate = sample_rate
+    self.play_rate = play_rate
+    self.sma_window = sma_window
+    self.block_size = block_size
+    self.N_max = sample_rate // play_rate
+
+    self.dtype = np.dtype(dtype)
+    self.real_dtype = np.finfo(self.dtype).dtype
+    if resync is None and self.dtype == np.complex64:
+      resync = sample_rate
+    self.resync = resync
+
+    self.N = plan.N.astype(np.int64)
+    self.k = plan.k
+    self.twiddle = np.exp(2j * pi * self.k / self.N).astype(self.dtype)
+
+    # Table of e^((j2pi p)/N) for p in [0, N) for every key, flattened
+    self.offsets = np.concatenate(([0], np.cumsum(self.N)[:-1]))
+    self.phasors = np.concatenate(
+      [np.exp(2j * pi * np.arange(N) / N) for N in self.N]).astype(self.dtype)
+
+    self.reset()
+    dbg_print(f'Done. Max window size is {self.N_max}')
+
+  def reset(self):
+    '''Zeroes every window buffer and moving average'''
+    K = len(self.N)
+    self.n = 0
+    self.X_k = np.zeros(K, dtype=self.dtype)
+    self.w = np.zeros(self.N_max, dtype=self.real_dtype)
+    self.X_k_W = np.zeros((self.sma_window, K), dtype=self.dtype)
+    self.x_n_W = np.zeros((self.sma_window, K), dtype=self.dtype)
+
+  def resync_X_k(self):
+    '''
+    Recomputes X_k exactly from the window buffer, X_k(n) = sum_{j<N} x[n-j]
+    W^(j+1), one key at a time from the phasor table so no (N_max, keys)
+    matrix is kept. Accumulated in double precision.
+    '''
+    X_k = np.empty(len(self.N), dtype=complex)
+    w = self.w.astype(float)
+    for i, (N, k, offset) in enumerate(zip(self.N, self.k, self.offsets)):
+      j = np.arange(N)
+      X_k[i] = w[self.N_max - 1 - j] @ self.phasors[offset + (j + 1) * k % N].astype(complex)
+    return X_k.astype(self.dtype)
+
+  def push(self, W, values, n):
+    '''Writes values, the outputs for samples n, n+1, ..., into ring buffer W'''
+    S = len(W)
+    if len(values) > S:
+      n += len(values) - S
+      values = values[-S:]
+    W[(n + np.arange(len(values))) % S] = values
+
+  def process(self, x):
+    '''
+    Advances every bin by the samples in x
+
+    ### Parameters
+    - x : A block of time-series samples, continuing from the last call
+
+    ### Returns
+    - X_k : (frames, keys) array of the X_k SMA at every frame boundary in x
+    - x_n : (frames, keys) array of the x[n] SMA at the same boundaries
+    '''
+    x = np.asarray(x, dtype=self.real_dtype)
+    B = len(x)
+    K = len(self.N)
+    if B == 0:
+      return np.zeros((0, K), dtype=self.dtype), np.zeros((0, K), dtype=self.dtype)
+
+    H = self.N_max
+
+    # x[n-N] for every sample and key
+    padded = np.concatenate((self.w, x))
+    bottom = padded[H + np.arange(B)[:, None] - self.N]
+
+    # Eq. (1), unrolled over the block
+    p = ((self.n + np.arange(B))[:, None] * self.k) % self.N
+    W_m = self.phasors[self.offsets + p]
+    X_k = np.cumsum((x[:, None] - bottom) / W_m, axis=0)
+    X_k += self.X_k / W_m[0]
+    X_k *= W_m
+    X_k *= self.twiddle
+
+    # x[n] from consecutive X_k, see SDFTBin.update_x_n
+    x_n = X_k / self.twiddle
+    x_n[0] -= self.X_k
+    x_n[1:] -= X_k[:-1]
+    x_n += bottom
+
+    # Moving averages at the frame boundaries within this block
+    S = self.sma_window
+    X_k_SMA, x_n_SMA = [], []
+    start = 0
+    for f in range((-self.n) % self.N_max, B, self.N_max):
+      self.push(self.X_k_W, X_k[start:f+1], self.n + start)
+      self.push(self.x_n_W, x_n[start:f+1], self.n + start)
+      X_k_SMA.append(self.X_k_W.sum(axis=0) / S)
+      x_n_SMA.append(self.x_n_W.sum(axis=0) / S)
+      start = f + 1
+    self.push(self.X_k_W, X_k[start:], self.n + start)
+    self.push(self.x_n_W, x_n[start:], self.n + start)
+
+    # Wrapping up
+    self.w = padded[-H:]
+    self.X_k = X_k[-1].copy()
+    self.n += B
+    if self.resync and self.n // self.resync != (self.n - B) // self.resync:
+      self.X_k = self.resync_X_k()
+
+    return (np.array(X_k_SMA, dtype=self.dtype).reshape(-1, K),
+            np.array(x_n_SMA, dtype=self.dtype).reshape(-1, K))
+
+  def update(self, x_n):
+    '''Advances every bin by a single sample, see process'''
+    return self.process([x_n])
+
+  def parse(self, x):
+    '''
+    Parses an array representing all time-series samples, block by block.
+
+    ### Returns
+    - X_k : (keys, frames) array, row i matches SDFTBin.parse for key i
+    - x_n : (keys, frames) array of the reconstructed x[n] SMA
+    '''
+    X_k, x_n = [], []
+    for start in range(0, len(x), self.block_size):
+      X_k_b, x_n_b = self.process(x[start:start + self.block_size])
+      X_k.append(X_k_b)
+      x_n.append(x_n_b)
+    K = len(self.N)
+    X_k = np.concatenate(X_k) if X_k else np.zeros((0, K), dtype=self.dtype)
+    x_n = np.concatenate(x_n) if x_n else np.zeros((0, K), dtype=self.dtype)
+    return X_k.T, x_n.T
+
+
+##################################
+## Frame-wise Windowed DFT Bank ##
+##################################
+
+class FrameBank:
+  '''
+  Evaluates the X_k SMA of every key only at the frame boundaries.
+
+  Unrolling Eq. (1) gives X_k(m) = sum_{i=m-N+1}^{m} x[i] W^(m-i+1), so the SMA
+  over the last S values of X_k at frame boundary n is a fixed windowed DFT of
+  the last S+N-1 samples
+
+  SMA(n) = sum_t x[n-t] h(t),  h(t) = (1/S) sum_{d=max(0,t-S+1)}^{min(N-1,t)} W^(d+1)
+
+  Each frame then costs one dot product per key, and none of the per-sample
+  updates between frames are computed. Results match SDFTBin.parse.
+  '''
+
+  def __init__(self, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+               sma_window = SMA_WINDOW, plan = None):
+    if plan is None:
+      plan = BinPlan.get(note_frequencies, sample_rate, play_rate)
+    self.sample_rate = sample_rate
+    self.play_rate = play_rate
+    self.sma_window = sma_window
+    self.N_max = sample_rate // play_rate
+
+    S = sma_window
+    self.L = S + int(plan.N.max()) - 1
+    # Kernels stored time-reversed, one column per key, so that a frame is the
+    # product of the L samples leading up to it with this matrix
+    self.kernels = np.zeros((self.L, len(plan)), dtype=complex)
+    for i, (N, k, _, _) in enumerate(plan):
+      W = e**((1j * 2*pi * k)/N)
+      P = np.concatenate(([0], np.cumsum(W ** np.arange(1, N + 1))))
+      t = np.arange(S + N - 1)
+      h = (P[np.minimum(N - 1, t) + 1] - P[np.maximum(0, t - S + 1)]) / S
+      self.kernels[self.L - len(t):, i] = h[::-1]
+
+  def parse(self, x, reconstruct = True):
+    '''
+    Evaluates every key at every frame boundary of x
+
+    ### Returns
+    - X_k : (keys, frames) array, row i matches SDFTBin.parse for key i
+    - x_n : (keys, frames) array of the reconstructed x[n] SMA, None unless
+      reconstruct is set
+    '''
+    K = self.kernels.shape[1]
+    frames = np.arange(0, len(x), self.N_max)
+
+    X_k = np.zeros((len(frames), K), dtype=complex)
+    for start in range(0, len(frames), FRAME_CHUNK):
+      chunk = frame_windows(x, frames[start:start + FRAME_CHUNK], self.L)
+      X_k[start:start + len(chunk)] = chunk @ self.kernels.real + 1j * (chunk @ self.kernels.imag)
+
+    x_n = reconstruct_frames(x, K, self.N_max, self.sma_window) if reconstruct else None
+    return X_k.T, x_n
+
+
+##################################
+## STFT + Sparse Key Filterbank ##
+##################################
+
+class STFTBank:
+  '''
+  Approximates the key magnitudes with one real FFT per output frame.
+
+  Every frame takes the Hann windowed N_max samples leading up to the frame
+  boundary, zero padded to nfft, and projects the magnitude spectrum onto the
+  keys through a sparse (bins, keys) matrix that linearly interpolates between
+  the two FFT bins around each key frequency.
+
+  Rows are scaled by N / sum(window), so a steady tone reads as the
+  unaveraged |X_k| of the key's SDFT bin. The SDFT engines report the SMA of
+  X_k instead, which averages a rotating phasor and is much smaller, so only
+  compare the two after normalizing (see bench.compare_engines).
+  '''
+
+  def __init__(self, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+               zero_pad = 4, sma_window = SMA_WINDOW, plan = None):
+    if plan is None:
+      plan = BinPlan.get(note_frequencies, sample_rate, play_rate)
+    K = len(plan)
+    self.sample_rate = sample_rate
+    self.play_rate = play_rate
+    self.N_max = sample_rate // play_rate
+    self.sma_window = sma_window
+    self.window = np.hanning(self.N_max)
+    self.nfft = 1 << int(np.ceil(np.log2(zero_pad * self.N_max)))
+
+    bins = self.nfft // 2 + 1
+    position = np.asarray(note_frequencies, dtype=float) * self.nfft / sample_rate
+    low = np.minimum(np.floor(position).astype(int), bins - 2)
+    frac = np.clip(position - low, 0, 1)
+    scale = plan.N / self.window.sum()
+    self.weights = csr_matrix(
+      (np.concatenate(((1 - frac) * scale, frac * scale)),
+       (np.concatenate((low, low + 1)), np.tile(np.arange(K), 2))),
+      shape=(bins, K))
+
+  def parse(self, x, reconstruct = True):
+    '''
+    Evaluates every key at every frame boundary of x
+
+    ### Returns
+    - X_k : (keys, frames) array of key magnitudes
+    - x_n : (keys, frames) array of the x[n] SMA, as in the SDFT engines, None
+      unless reconstruct is set
+    '''
+    K = self.weights.shape[1]
+    frames = np.arange(0, len(x), self.N_max)
+
+    X_k = np.zeros((K, len(frames)), dtype=complex)
+    for start in range(0, len(frames), FRAME_CHUNK):
+      chunk = frame_windows(x, frames[start:start + FRAME_CHUNK], self.N_max) * self.window
+      spectrum = np.abs(np.fft.rfft(chunk, n=self.nfft, axis=1))
+      X_k[:, start:start + len(chunk)] = self.weights.T @ spectrum.T
+
+    x_n = reconstruct_frames(x, K, self.N_max, self.sma_window) if reconstruct else None
+    return X_k, x_n
+
+
+def boxcar_at(y, frames, window = SMA_WINDOW):
+  '''
+  Returns the SMA of y at the indices in frames, i.e the same value a
+  MovingAverage of size window fed with y holds after y[n]
+  '''
+  C = np.concatenate(([0], np.cumsum(y)))
+  return (C[frames + 1] - C[np.maximum(frames + 1 - window, 0)]) / window
+
+def frame_windows(x, frames, length):
+  '''
+  Returns the (frames, length) matrix of the length samples leading up to
+  (and including) every frame boundary, zero padded before the first sample.
+
+  Only x[frames[0] - length + 1 : frames[-1] + 1] is read, so x can be any
+  sliceable source of samples such as an ingest.WavSource.
+  '''
+  low = frames[0] - length + 1
+  segment = np.asarray(x[max(low, 0):frames[-1] + 1], dtype=float)
+  if low < 0:
+    segment = np.concatenate((np.zeros(-low), segment))
+  return sliding_window_view(segment, length)[frames - frames[0]]
+
+def reconstruct_frames(x, keys, N_max, window = SMA_WINDOW, chunk = FRAME_CHUNK):
+  '''
+  Returns the (keys, frames) x[n] SMA of every key at every frame boundary.
+  The x[n] a bin reconstructs from X_k is x[n] itself, so this is the same
+  boxcar of the audio for every key and needs none of the SDFT state.
+
+  x is read chunk frames at a time, see frame_windows.
+  '''
+  frames = np.arange(0, len(x), N_max)
+  SMA = np.zeros(len(frames), dtype=complex)
+  for start in range(0, len(frames), chunk):
+    f = frames[start:start + chunk]
+    low = max(f[0] - window + 1, 0)
+    segment = np.asarray(x[low:f[-1] + 1], dtype=float)
+    SMA[start:start + len(f)] = boxcar_at(segment, f - low, window)
+  return np.tile(SMA, (keys, 1))
+
+
+#############
+## Engines ##
+#############
+
+def parse_bins(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+               reconstruct = True, sma_window = SMA_WINDOW, plan = None):
+  '''Runs one SDFTBin per key over x, one key at a time'''
+  if plan is None:
+    plan = BinPlan.get(note_frequencies, sample_rate, play_rate)
+  x = np.asarray(x, dtype=float)
+  X_k, x_n = [], []
+  for i, freq in enumerate(note_frequencies):
+    if DEBUG:
+      dbg_print(f'Parsing audio file for key {i+1}')
+    X_k_i, x_n_i = SDFTBin(freq, sample_rate, play_rate, plan[i],
+                           sma_window=sma_window).parse(x)
+    X_k.append(X_k_i)
+    x_n.append(x_n_i)
+  return np.array(X_k, dtype=complex), np.array(x_n, dtype=complex) if reconstruct else None
+
+def parse_bank32(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+                 reconstruct = True, sma_window = SMA_WINDOW, plan = None):
+  '''Runs every key at once through a single precision SDFTBank'''
+  X_k, x_n = SDFTBank(note_frequencies, sample_rate, play_rate, sma_window,
+                      dtype=np.complex64, plan=plan).parse(x)
+  return X_k, x_n if reconstruct else None
+
+def parse_block(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+                reconstruct = True, sma_window = SMA_WINDOW, plan = None):
+  '''Runs SDFTBin.parse_block for every key, filtering the whole signal at once'''
+  if plan is None:
+    plan = BinPlan.get(note_frequencies, sample_rate, play_rate)
+  x = np.asarray(x, dtype=float)
+  X_k, x_n = [], []
+  for i, freq in enumerate(note_frequencies):
+    X_k_i, x_n_i = SDFTBin(freq, sample_rate, play_rate, plan[i],
+                           sma_window=sma_window).parse_block(x)
+    X_k.append(X_k_i)
+    x_n.append(x_n_i)
+  return np.array(X_k, dtype=complex), np.array(x_n, dtype=complex) if reconstruct else None
+
+def parse_bank(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+               reconstruct = True, sma_window = SMA_WINDOW, plan = None):
+  '''Runs every key at once through an SDFTBank'''
+  X_k, x_n = SDFTBank(note_frequencies, sample_rate, play_rate, sma_window,
+                      plan=plan).parse(x)
+  return X_k, x_n if reconstruct else None
+
+def parse_frames(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+                 reconstruct = True, sma_window = SMA_WINDOW, plan = None):
+  '''Evaluates every key only at the frame boundaries with a FrameBank'''
+  return FrameBank(note_frequencies, sample_rate, play_rate,
+                   sma_window, plan).parse(x, reconstruct)
+
+def parse_stft(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+               reconstruct = True, sma_window = SMA_WINDOW, plan = None):
+  '''Projects one FFT per frame onto the keys with an STFTBank'''
+  return STFTBank(note_frequencies, sample_rate, play_rate,
+                  sma_window=sma_window, plan=plan).parse(x, reconstruct)
+
+ENGINES = {
+  'sdft' : parse_bins,
+  'bank' : parse_bank,
+  'bank32' : parse_bank32,
+  'block' : parse_block,
+  'frame' : parse_frames,
+  'stft' : parse_stft,
+}
+DEFAULT_ENGINE = 'frame'
+
+def decimation_factor(note_frequencies, sample_rate, play_rate = PLAY_RATE,
+                      sma_window = SMA_WINDOW, margin = DECIMATION_MARGIN):
+  '''
+  Returns the largest factor q the audio can be decimated by so that the
+  highest key stays below margin times the new Nyquist frequency, and frames
+  and the SMA window still fall on whole samples at the new rate (q divides
+  the sample rate, the frame length N_max and sma_window). Returns 1 when
+  the audio can't be decimated.
+  '''
+  N_max = sample_rate // play_rate
+  highest = max(note_frequencies)
+  for q in range(int(sample_rate * margin / (2 * highest)), 1, -1):
+    if (sample_rate % q == 0 and N_max % q == 0 and sma_window % q == 0
+        and (sample_rate // q) // play_rate == N_max // q):
+      return q
+  return 1
+
+def analyze(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+            engine = DEFAULT_ENGINE, workers = 1, reconstruct = True,
+            decimate = False, stats = None):
+  '''
+  Computes the X_k and x[n] SMAs of every key at the piano play rate
+
+  ### Parameters
+  - x : All time-series samples
+  - note_frequencies : The frequency of every key to analyze, any subset of
+    the piano. Only these keys get bins, windows and SMAs, and a lower
+    highest key lets decimate go further
+  - engine : One of ENGINES
+  - workers : Number of processes the keys are spread across
+  - reconstruct : Also return x_n, the frame and stft engines skip computing
+    it otherwise
+  - decimate : Analyze x low pass filtered and decimated to the lowest rate
+    that covers the highest key, see decimation_factor. The bin plan and SMA
+    window are derived for that rate, and the results are reported on the
+    original timeline and scale
+  - stats : Optional instrument.Stats to time the bin plan and engine on
+
+  ### Returns
+  - X_k : (keys, frames) array of X_k sampled at the piano rate
+  - x_n : (keys, frames) array of the reconstructed x[n], or None
+  '''
+  if engine not in ENGINES:
+    raise ValueError(f'Unknown SDFT engine {engine}, expected one of {list(ENGINES)}')
+
+  with stage(stats, 'bin_plan'):
+    plan = BinPlan.get(note_frequencies, sample_rate, play_rate)
+
+  q = decimation_factor(note_frequencies, sample_rate, play_rate) if decimate else 1
+  source, rate, sma_window = x, sample_rate, SMA_WINDOW
+  if q > 1:
+    source, rate, sma_window = DecimatedSource(x, q), sample_rate // q, SMA_WINDOW // q
+    plan = plan.decimated(q)
+
+  with stage(stats, f'analyze[{engine}]'):
+    if workers > 1 and len(note_frequencies) > 1:
+      X_k, x_n = analyze_parallel(source, note_frequencies, rate, play_rate, engine,
+                                  workers, reconstruct and q == 1, sma_window, plan)
+    else:
+      X_k, x_n = ENGINES[engine](source, note_frequencies, rate, play_rate,
+                                 reconstruct and q == 1, sma_window=sma_window,
+                                 plan=plan)
+
+  if q > 1:
+    # Frame i is sample i * N_max / q of the decimated audio, i.e sample
+    # i * N_max of x, and every X_k sums q times fewer samples
+    X_k *= q
+    if reconstruct:
+      x_n = reconstruct_frames(x, len(note_frequencies), sample_rate // play_rate)
+
+  if stats is not None:
+    stats.count('samples_processed', len(x))
+    stats.count('samples_analyzed', len(source))
+    stats.count('keys_analyzed', len(note_frequencies))
+    stats.count('frames_emitted', X_k.shape[1])
+  return X_k, x_n
+
+
+#####################
+## Parallel Engine ##
+#####################
+
+# The audio shared with a worker process, see attach_audio
+shared_audio = None
+
+def attach_audio(name, shape, dtype):
+  '''Pool initializer, maps the shared audio buffer into this worker'''
+  global shared_audio
+  shm = SharedMemory(name=name)
+  # Keep the handle alive for as long as the array is
+  shared_audio = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+def analyze_keys(keys, note_frequencies, sample_rate, play_rate, engine, reconstruct,
+                 sma_window, plan):
+  '''Runs one engine over the shared audio for a group of keys'''
+  X_k, x_n = ENGINES[engine](shared_audio[1], note_frequencies, sample_rate, play_rate,
+                             reconstruct, sma_window=sma_window, plan=plan)
+  return keys, X_k, x_n
+
+def analyze_parallel(x, note_frequencies, sample_rate, play_rate, engine, workers,
+                     reconstruct = True, sma_window = SMA_WINDOW, plan = None):
+  '''
+  Spreads the keys across a pool of processes. The audio is copied once into
+  shared memory rather than pickled to every worker, and every worker sends
+  back only the frames of its keys.
+  '''
+  x = np.asarray(x)
+  K = len(note_frequencies)
+  workers = min(workers, K)
+
+  # Interleave keys so every group gets a mix of long and short windows
+  groups = [list(range(K))[g::workers] for g in range(workers)]
+  if plan is None:
+    plan = BinPlan.get(note_frequencies, sample_rate, play_rate)
+  tasks = [(keys, [note_frequencies[i] for i in keys], sample_rate, play_rate, engine,
+            reconstruct, sma_window, plan.take(keys)) for keys in groups]
+
+  shm = SharedMemory(create=True, size=max(x.nbytes, 1))
+  try:
+    np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)[:] = x
+    with Pool(workers, initializer=attach_audio,
+              initargs=(shm.name, x.shape, x.dtype.str)) as pool:
+      results = pool.starmap(analyze_keys, tasks)
+  finally:
+    shm.close()
+    shm.unlink()
+
+  F = results[0][1].shape[1]
+  X_k = np.zeros((K, F), dtype=complex)
+  x_n = np.zeros((K, F), dtype=complex) if reconstruct else None
+  for keys, X_k_g, x_n_g in results:
+    X_k[keys] = X_k_g
+    if reconstruct:
+      x_n[keys] = x_n_g
+  return X_k, x_n
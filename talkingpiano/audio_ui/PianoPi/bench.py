@@ -0,0 +1,363 @@
+'''
+Benchmarks for the PianoPi analysis pipeline
+
+Usage, from the talkingpiano directory:
+
+  python -m audio_ui.PianoPi.bench
+    Runs the synthetic suite: pure key tones, chords, chirps and noise at
+    several lengths and sample rates through every engine and pipeline stage
+
+  python -m audio_ui.PianoPi.bench media/records/C4vH.wav
+    Compares the engines on a single recording
+'''
+
+#############
+## Imports ##
+#############
+
+from .SDFT import analyze, SDFTBin, SDFTBank, ENGINES, PLAY_RATE, MAGNITUDE_MAX
+from . import scheduler
+from contextlib import redirect_stdout
+from scipy.io import wavfile
+import numpy as np
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+###############
+## Constants ##
+###############
+
+SUITE_LENGTHS = (1, 5)
+SUITE_SAMPLE_RATES = (16000, 44100, 48000)
+SUITE_ENGINES = ('bank', 'bank32', 'block', 'frame', 'stft')
+
+# Peak amplitude of the synthetic fixtures
+FIXTURE_AMPLITUDE = 0.5 * MAGNITUDE_MAX
+
+
+#########################
+## Engine Comparisons ##
+#########################
+
+def time_engine(x, note_frequencies, sample_rate, engine, play_rate = PLAY_RATE):
+  '''Returns the key magnitudes an engine computes for x and the seconds it took'''
+  start = time.perf_counter()
+  X_k, _ = analyze(x, note_frequencies, sample_rate, play_rate, engine=engine)
+  return np.abs(X_k), time.perf_counter() - start
+
+def compare_engines(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+                    engines = ('bank', 'block', 'frame', 'stft'), reference = 'bank'):
+  '''
+  Runs every engine over x and compares it against the reference engine
+
+  Magnitudes are normalized by their maximum before comparing, since not every
+  engine reports on the same scale (see STFTBank).
+
+  ### Returns
+  A dict keyed by engine with
+  - seconds : Wall time of the analysis
+  - realtime : Seconds of audio analyzed per wall second
+  - error : Largest difference between the normalized magnitudes
+  - key_agreement : Fraction of frames whose loudest key matches the reference
+  '''
+  audio_seconds = len(x) / sample_rate
+  ref, _ = time_engine(x, note_frequencies, sample_rate, reference, play_rate)
+  ref_norm = ref / max(ref.max(), np.finfo(float).tiny)
+  active = ref.max(axis=0) > 0
+
+  report = {}
+  for engine in engines:
+    M, seconds = time_engine(x, note_frequencies, sample_rate, engine, play_rate)
+    M_norm = M / max(M.max(), np.finfo(float).tiny)
+    agreement = np.argmax(M, axis=0)[active] == np.argmax(ref, axis=0)[active]
+    report[engine] = {
+      'seconds' : seconds,
+      'realtime' : audio_seconds / seconds,
+      'error' : float(np.max(np.abs(M_norm - ref_norm))),
+      'key_agreement' : float(agreement.mean()) if agreement.size else 1.0,
+    }
+  return report
+
+def precision_report(x, note_frequencies, sample_rate, play_rate = PLAY_RATE,
+                     resync = 'default'):
+  '''
+  Compares a single precision SDFTBank against the double precision one
+
+  ### Parameters
+  - resync : Passed on to the single precision bank, 0 disables resyncing
+
+  ### Returns
+  The relative error of every key, the largest difference between the two
+  X_k SMAs over the key's largest double precision magnitude
+  '''
+  X_64, _ = SDFTBank(note_frequencies, sample_rate, play_rate).parse(x)
+  kwargs = {} if resync == 'default' else {'resync' : resync}
+  X_32, _ = SDFTBank(note_frequencies, sample_rate, play_rate,
+                     dtype=np.complex64, **kwargs).parse(x)
+  peak = np.maximum(np.abs(X_64).max(axis=1), np.finfo(float).tiny)
+  return np.abs(X_32 - X_64).max(axis=1) / peak
+
+##############
+## Fixtures ##
+##############
+
+def key_frequency(key):
+  '''Frequency of a 1-indexed piano key'''
+  return (2**((key-49)/12))*440
+
+def tone(keys, seconds, sample_rate):
+  '''Sum of steady sines at the given piano keys'''
+  t = np.arange(int(seconds * sample_rate)) / sample_rate
+  x = sum(np.sin(2*np.pi * key_frequency(key) * t) for key in keys)
+  return FIXTURE_AMPLITUDE * x / len(keys)
+
+def chirp(seconds, sample_rate, low_key = 1, high_key = 88):
+  '''Exponential sweep from low_key to high_key'''
+  t = np.arange(int(seconds * sample_rate)) / sample_rate
+  f_0, f_1 = key_frequency(low_key), min(key_frequency(high_key), sample_rate / 2)
+  rate = np.log(f_1 / f_0) / seconds
+  return FIXTURE_AMPLITUDE * np.sin(2*np.pi * f_0 * (np.exp(rate * t) - 1) / rate)
+
+def noise(seconds, sample_rate, seed = 0):
+  '''White noise'''
+  x = np.random.default_rng(seed).uniform(-1, 1, int(seconds * sample_rate))
+  return FIXTURE_AMPLITUDE * x
+
+def synthetic_fixtures(lengths = SUITE_LENGTHS, sample_rates = SUITE_SAMPLE_RATES):
+  '''Yields (name, sample rate, int16 samples) for every synthetic fixture'''
+  for sample_rate in sample_rates:
+    for seconds in lengths:
+      signals = {
+        'A4' : tone([49], seconds, sample_rate),
+        'C_major' : tone([40, 44, 47], seconds, sample_rate),
+        'chirp' : chirp(seconds, sample_rate),
+        'noise' : noise(seconds, sample_rate),
+      }
+      for name, x in signals.items():
+        yield f'{name}_{seconds}s_{sample_rate}Hz', sample_rate, x.astype(np.int16)
+
+def write_fixture(directory, name, sample_rate, x):
+  '''Writes a fixture as a wav file and returns its path'''
+  file_path = os.path.join(directory, f'{name}.wav')
+  wavfile.write(file_path, sample_rate, x)
+  return file_path
+
+
+###############
+## Measuring ##
+###############
+
+def measure(fn, *args, memory = True, **kwargs):
+  '''
+  Runs fn once for its wall time and, if memory is set, once more under
+  tracemalloc for its peak allocations
+
+  ### Returns
+  - result : What fn returned
+  - seconds : Wall time of the untraced run
+  - peak : Peak bytes allocated during the traced run, or None
+  '''
+  start = time.perf_counter()
+  result = fn(*args, **kwargs)
+  seconds = time.perf_counter() - start
+
+  peak = None
+  if memory:
+    tracemalloc.start()
+    try:
+      fn(*args, **kwargs)
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+  return result, seconds, peak
+
+def reference_magnitudes(x, note_frequencies, sample_rate, play_rate = PLAY_RATE):
+  '''
+  Reference key magnitudes: the DFT of the Hann windowed sample_rate //
+  play_rate samples leading up to every frame boundary, evaluated exactly at
+  every key frequency
+
+  ### Returns
+  (keys, frames) array of magnitudes
+  '''
+  x = np.asarray(x, dtype=float)
+  N_max = sample_rate // play_rate
+  frames = np.arange(0, len(x), N_max)
+  t = np.arange(N_max)
+  basis = np.hanning(N_max)[:, None] * np.exp(
+    -2j*np.pi * t[:, None] * np.asarray(note_frequencies)[None, :] / sample_rate)
+
+  padded = np.concatenate((np.zeros(N_max - 1), x))
+  windows = np.lib.stride_tricks.sliding_window_view(padded, N_max)[frames]
+  return np.abs(windows @ basis).T
+
+def key_accuracy(M, ref):
+  '''
+  Per-key accuracy of the magnitudes M against ref, both (keys, frames)
+
+  ### Returns
+  - correlation : Correlation of every key's magnitude through time with the
+    reference, NaN for keys that are constant in either
+  - key_agreement : Fraction of frames whose loudest key matches the reference
+  '''
+  M = np.abs(M)
+  dM = M - M.mean(axis=1, keepdims=True)
+  dref = ref - ref.mean(axis=1, keepdims=True)
+  norm = np.sqrt((dM**2).sum(axis=1) * (dref**2).sum(axis=1))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    correlation = (dM * dref).sum(axis=1) / norm
+
+  active = ref.max(axis=0) > 0
+  agreement = np.argmax(M, axis=0)[active] == np.argmax(ref, axis=0)[active]
+  return correlation, float(agreement.mean()) if agreement.size else 1.0
+
+
+###########
+## Suite ##
+###########
+
+def bench_engines(name, sample_rate, x, note_frequencies, engines = SUITE_ENGINES,
+                  memory = True):
+  '''Benchmarks every engine on one fixture, returns one row per engine'''
+  ref = reference_magnitudes(x, note_frequencies, sample_rate)
+  rows = []
+  for engine in engines:
+    (X_k, _), seconds, peak = measure(analyze, x, note_frequencies, sample_rate,
+                                      engine=engine, memory=memory)
+    correlation, agreement = key_accuracy(X_k, ref)
+    rows.append({
+      'fixture' : name,
+      'stage' : f'analyze[{engine}]',
+      'seconds' : seconds,
+      'realtime' : len(x) / sample_rate / seconds,
+      'peak_bytes' : peak,
+      'key_correlation' : correlation,
+      'key_agreement' : agreement,
+    })
+  return rows
+
+def bench_stages(name, sample_rate, x, directory, memory = True):
+  '''
+  Benchmarks the PianoPi pipeline stages on one fixture. Runs inside
+  directory since PianoPi writes its outputs relative to the working directory.
+  '''
+  from .piano_pi import PianoPi
+
+  file_path = write_fixture(directory, name, sample_rate, x)
+  audio_seconds = len(x) / sample_rate
+  stages = []
+
+  def run(stage, fn, *args, scale = 1):
+    '''Measures one stage, a failing stage is reported rather than raised'''
+    try:
+      result, seconds, peak = measure(fn, *args, memory=memory)
+      stages.append((stage, seconds * scale, peak, None))
+      return result
+    except Exception as err:
+      stages.append((stage, None, None, repr(err)))
+
+  cwd = os.getcwd()
+  os.chdir(directory)
+  try:
+    def analyzed():
+      piano = PianoPi(file_path, uuid=name)
+      piano.generate_output()
+      return piano
+
+    # PianoPi is lazy, every stage below recomputes on the analyzed instance
+    run('PianoPi.key_freq_through_time',
+        lambda: PianoPi(file_path, uuid=name).key_freq_through_time)
+    piano = run('PianoPi.generate_output', analyzed)
+    if piano is not None:
+      run('generate_piano_note_matrix', piano.generate_piano_note_matrix)
+      # The scheduler prints the whole performance matrix
+      with redirect_stdout(io.StringIO()):
+        run('scheduler.init', scheduler.init, piano)
+      tsv_path = run('generate_tsv', piano.generate_tsv)
+      if tsv_path is not None:
+        with redirect_stdout(io.StringIO()):
+          run('scheduler.init[tsv]', scheduler.init, tsv_path)
+
+    # A single pure Python bin over at most a second of audio, scaled up to
+    # the length of the fixture
+    x_bin = x[:sample_rate]
+    run('SDFTBin.parse[1 key]', lambda: SDFTBin(440.0, sample_rate).parse(x_bin),
+        scale=len(x) / len(x_bin))
+  finally:
+    os.chdir(cwd)
+
+  return [{
+    'fixture' : name,
+    'stage' : stage,
+    'seconds' : seconds,
+    'realtime' : None if seconds is None else audio_seconds / seconds,
+    'peak_bytes' : peak,
+    'error' : error,
+  } for stage, seconds, peak, error in stages]
+
+def run_suite(lengths = SUITE_LENGTHS, sample_rates = SUITE_SAMPLE_RATES,
+              engines = SUITE_ENGINES, stages = True, memory = True):
+  '''
+  Runs every fixture through every engine and, for fixtures at the native
+  SAMPLE_RATE, through the PianoPi pipeline stages
+
+  ### Returns
+  A list of rows with the fixture, stage, seconds, realtime factor (audio
+  seconds per wall second), peak bytes and, for engines, the per-key
+  correlation with the reference DFT and the loudest key agreement
+  '''
+  from .piano_pi import PIANO_KEY_FREQUENCIES
+  from .SDFT import SAMPLE_RATE
+
+  rows = []
+  with tempfile.TemporaryDirectory() as directory:
+    for name, sample_rate, x in synthetic_fixtures(lengths, sample_rates):
+      rows += bench_engines(name, sample_rate, x, PIANO_KEY_FREQUENCIES, engines, memory)
+      if stages and sample_rate == SAMPLE_RATE:
+        rows += bench_stages(name, sample_rate, x, directory, memory)
+  return rows
+
+def print_suite(rows):
+  print(f'{"fixture":<24}{"stage":<30}{"seconds":>9}{"x realtime":>12}'
+        f'{"peak MB":>9}{"mean corr":>10}{"key match":>10}')
+  for row in rows:
+    if row.get('error'):
+      print(f'{row["fixture"]:<24}{row["stage"]:<30} failed: {row["error"]}')
+      continue
+    peak = '' if row['peak_bytes'] is None else f'{row["peak_bytes"] / 2**20:.1f}'
+    corr = row.get('key_correlation')
+    corr = '' if corr is None else f'{np.nanmean(corr):.3f}' if np.any(~np.isnan(corr)) else 'nan'
+    agreement = row.get('key_agreement')
+    agreement = '' if agreement is None else f'{agreement:.1%}'
+    print(f'{row["fixture"]:<24}{row["stage"]:<30}{row["seconds"]:>9.3f}'
+          f'{row["realtime"]:>12.1f}{peak:>9}{corr:>10}{agreement:>10}')
+
+def print_report(report):
+  print(f'{"engine":<8}{"seconds":>10}{"x realtime":>12}{"error":>12}{"key match":>11}')
+  for engine, r in report.items():
+    print(f'{engine:<8}{r["seconds"]:>10.3f}{r["realtime"]:>12.1f}'
+          f'{r["error"]:>12.2e}{r["key_agreement"]:>11.1%}')
+
+
+if __name__ == '__main__':
+  from .piano_pi import PIANO_KEY_FREQUENCIES
+
+  if len(sys.argv) < 2:
+    print_suite(run_suite())
+    sys.exit(0)
+
+  sample_rate, audio = wavfile.read(sys.argv[1])
+  if len(np.shape(audio)) != 1:
+    audio = audio[:,0]
+  print_report(compare_engines(audio, PIANO_KEY_FREQUENCIES, sample_rate,
+                               engines=[e for e in ENGINES if e != 'sdft']))
+
+  errors = precision_report(audio, PIANO_KEY_FREQUENCIES, sample_rate)
+  print('\nSingle precision bank, relative error per key')
+  for i, error in enumerate(errors):
+    print(f'key{i+1:<3} {PIANO_KEY_FREQUENCIES[i]:>9.3f}Hz {error:.2e}')
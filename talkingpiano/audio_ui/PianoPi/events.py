@@ -0,0 +1,174 @@
+'''
+Sparse performances, a compact stand-in for dense (frames, keys) matrices.
+
+------------
+Events
+------------
+Both the piano note matrix and the scheduler's performance are almost all
+zeros. An event is one of their nonzero entries:
+
+column   | field
+0        | frame, the index of the frame it happens at
+1        | key, the piano key index (0-87)
+2        | action, PRESS or LIFT
+3        | velocity, the press strength quantized to 1-levels, 0 for a lift
+
+Events are sorted by frame then key. A dense matrix holds the velocity of a
+press (velocity / levels) and -1 for a lift, which is what
+scheduler.data_to_performance writes, and round trips up to the quantization.
+
+------------
+Payload
+------------
+to_payload packs events as JSON for the web page and the Pi, with the frame
+column delta encoded (every frame counts from the previous event's) and the
+events flattened:
+
+  {play_rate, frames, keys, levels, events: [frame delta, key, action,
+   velocity, frame delta, ...]}
+'''
+
+#############
+## Imports ##
+#############
+
+import numpy as np
+
+
+###############
+## Constants ##
+###############
+
+PRESS = 1
+LIFT = -1
+
+# Press strengths are quantized to 1-127, like MIDI velocities
+VELOCITY_LEVELS = 127
+
+# Columns of an event
+EVENT_FIELDS = ('frame', 'key', 'action', 'velocity')
+
+# The key columns a matrix holds when none are given
+PIANO_KEYS = 88
+
+
+######################
+## Dense and Sparse ##
+######################
+
+def encode(matrix, keys=None, levels=VELOCITY_LEVELS):
+  '''
+  Returns the events of a dense (frames, keys) matrix
+
+  ### Parameters
+  - matrix : Press strengths (0-1) and -1 for lifts, 0 elsewhere
+  - keys : The piano key index of every column, defaults to 0, 1, ...
+
+  ### Returns
+  - events : (events, 4) int32 array, see EVENT_FIELDS
+  '''
+  matrix = np.asarray(matrix)
+  keys = np.arange(matrix.shape[1]) if keys is None else np.asarray(keys)
+
+  # Row major, so already sorted by frame then key
+  frames, columns = np.nonzero(matrix)
+  values = matrix[frames, columns]
+  lift = values < 0
+  action = np.where(lift, LIFT, PRESS)
+  velocity = np.where(lift, 0, np.clip(np.round(values * levels), 1, levels))
+
+  return np.column_stack((frames, keys[columns], action, velocity)).astype(np.int32)
+
+def decode(events, frames=None, keys=None, levels=VELOCITY_LEVELS):
+  '''
+  Returns the dense (frames, keys) matrix of events, see encode
+
+  ### Parameters
+  - frames : Number of frames, defaults to one past the last event
+  - keys : The piano key index of every column, defaults to 0-87
+  '''
+  events = np.asarray(events, dtype=np.int64).reshape(-1, len(EVENT_FIELDS))
+  keys = np.arange(PIANO_KEYS) if keys is None else np.asarray(keys)
+  if frames is None:
+    frames = int(events[:, 0].max()) + 1 if len(events) else 0
+
+  # Piano key index to column, -1 for keys the matrix doesn't have
+  size = max(PIANO_KEYS, keys.max(initial=-1) + 1, events[:, 1].max(initial=-1) + 1)
+  column = np.full(size, -1)
+  column[keys] = np.arange(len(keys))
+  columns = column[events[:, 1]]
+  if np.any(columns < 0):
+    raise ValueError(f'Events for keys {np.unique(events[columns < 0, 1]).tolist()} which have no column')
+
+  matrix = np.zeros((frames, len(keys)))
+  matrix[events[:, 0], columns] = np.where(events[:, 2] == LIFT, -1,
+                                           events[:, 3] / levels)
+  return matrix
+
+def delta_encode(events):
+  '''Returns events with every frame counted from the previous event's'''
+  events = np.array(events, dtype=np.int32).reshape(-1, len(EVENT_FIELDS))
+  events[1:, 0] = np.diff(events[:, 0])
+  return events
+
+def delta_decode(events):
+  '''Inverse of delta_encode'''
+  events = np.array(events, dtype=np.int32).reshape(-1, len(EVENT_FIELDS))
+  events[:, 0] = np.cumsum(events[:, 0])
+  return events
+
+
+#############
+## Payload ##
+#############
+
+def to_payload(events, frames, play_rate, keys, levels=VELOCITY_LEVELS):
+  '''
+  Returns the JSON serializable payload of events, see the module docstring
+
+  ### Parameters
+  - frames : Number of frames of the performance
+  - keys : The piano key index of every column of the dense form
+  '''
+  return {
+    'play_rate' : float(play_rate),
+    'frames' : int(frames),
+    'keys' : np.asarray(keys).tolist(),
+    'levels' : levels,
+    'events' : delta_encode(events).ravel().tolist(),
+  }
+
+def from_payload(payload):
+  '''
+  Inverse of to_payload
+
+  ### Returns
+  - events : (events, 4) array with absolute frames
+  - frames, play_rate, keys, levels : As passed to to_payload
+  '''
+  return (delta_decode(payload['events']), payload['frames'], payload['play_rate'],
+          payload['keys'], payload['levels'])
+
+def payload_matrix(matrix, play_rate, keys=None, levels=VELOCITY_LEVELS):
+  '''Encodes a dense (frames, keys) matrix straight into a payload'''
+  keys = np.arange(np.shape(matrix)[1]) if keys is None else keys
+  return to_payload(encode(matrix, keys, levels), len(matrix), play_rate, keys, levels)
+
+
+##############
+## Playback ##
+##############
+
+def iter_frames(events):
+  '''
+  Groups events by frame for a player, skipping frames without any
+
+  ### Returns
+  - An iterator of (frame, events) with the (n, 4) events of every frame
+  '''
+  events = np.asarray(events).reshape(-1, len(EVENT_FIELDS))
+  if not len(events):
+    return
+  starts = np.flatnonzero(np.diff(events[:, 0])) + 1
+  for group in np.split(events, starts):
+    yield int(group[0, 0]), group
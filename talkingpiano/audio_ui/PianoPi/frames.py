@@ -0,0 +1,237 @@
+'''
+Binary frame files, a fixed-layout sibling of the tsv outputs.
+
+------------
+File layout
+------------
+Everything is little-endian.
+
+offset | type       | field
+0      | char[4]    | magic, b'PPFR'
+4      | uint16     | version
+6      | uint16     | dtype code, see DTYPES
+8      | uint32     | number of frames
+12     | uint32     | number of keys (columns)
+16     | float32    | play rate, frames per second
+20     | uint32     | sample rate of the analyzed audio
+24     | uint16[K]  | piano key index (0-87) of every column
+...    |            | zero padding up to a multiple of 16 bytes
+data   | dtype[F*K] | frames, one row of K values per frame
+
+Frame i starts at i / play_rate seconds, which is the time stamp column of
+the tsv. Reading a file needs nothing but struct and NumPy.
+'''
+
+#############
+## Imports ##
+#############
+
+import numpy as np
+import os
+import struct
+
+
+###############
+## Constants ##
+###############
+
+FRAME_MAGIC = b'PPFR'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<4sHHIIfI')
+
+# Data alignment, keeps complex64 frames aligned for memory mapping
+FRAME_ALIGN = 16
+
+DTYPES = {
+  0 : np.dtype('<f4'),
+  1 : np.dtype('<c8'),
+}
+
+# Rows written per call to write
+ROW_BLOCK = 1024
+
+
+##################
+## Reading and  ##
+## writing      ##
+##################
+
+def dtype_code(dtype):
+  dtype = np.dtype(dtype).newbyteorder('<')
+  for code, known in DTYPES.items():
+    if known == dtype:
+      return code
+  raise ValueError(f'Unsupported frame dtype {dtype}, expected one of {list(DTYPES.values())}')
+
+def data_offset(keys):
+  size = FRAME_HEADER.size + 2 * keys
+  return -(-size // FRAME_ALIGN) * FRAME_ALIGN
+
+def write_header(f, frames, keys, play_rate, sample_rate, dtype):
+  '''Writes the header and padding, returns the offset of the frame data'''
+  keys = np.asarray(keys, dtype='<u2')
+  f.write(FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, dtype_code(dtype),
+                            frames, len(keys), play_rate, sample_rate))
+  f.write(keys.tobytes())
+  offset = data_offset(len(keys))
+  f.write(b'\0' * (offset - FRAME_HEADER.size - keys.nbytes))
+  return offset
+
+def write_frames(file_path, frames, play_rate, sample_rate, keys=None, dtype='<f4'):
+  '''
+  Writes a (frames, keys) matrix as a frame file, ROW_BLOCK rows at a time
+
+  ### Parameters
+  - keys : The piano key index of every column, defaults to 0, 1, ...
+  - dtype : '<f4' or '<c8'
+  '''
+  dtype = np.dtype(dtype).newbyteorder('<')
+  F, K = np.shape(frames)
+  keys = np.arange(K) if keys is None else keys
+
+  with open(file_path, 'wb') as f:
+    write_header(f, F, keys, play_rate, sample_rate, dtype)
+    for start in range(0, F, ROW_BLOCK):
+      f.write(np.ascontiguousarray(frames[start:start + ROW_BLOCK], dtype=dtype).tobytes())
+
+  return file_path
+
+def read_header(file_path):
+  '''
+  Returns the header of a frame file as a dict with the version, dtype,
+  frames, keys (column to piano key indices), play_rate, sample_rate and the
+  offset of the frame data
+  '''
+  with open(file_path, 'rb') as f:
+    magic, version, code, frames, K, play_rate, sample_rate = FRAME_HEADER.unpack(
+      f.read(FRAME_HEADER.size))
+    if magic != FRAME_MAGIC:
+      raise ValueError(f'{file_path} is not a frame file')
+    if version != FRAME_VERSION or code not in DTYPES:
+      raise ValueError(f'Unsupported frame file {file_path} (version {version}, dtype {code})')
+    keys = np.frombuffer(f.read(2 * K), dtype='<u2').astype(int)
+
+  return {
+    'version' : version,
+    'dtype' : DTYPES[code],
+    'frames' : frames,
+    'keys' : keys,
+    'play_rate' : play_rate,
+    'sample_rate' : sample_rate,
+    'offset' : data_offset(K),
+  }
+
+def read_frames(file_path, mmap=False):
+  '''
+  Reads a frame file
+
+  ### Returns
+  - header : See read_header
+  - frames : (frames, keys) array, memory mapped read-only if mmap is set
+  '''
+  header = read_header(file_path)
+  shape = (header['frames'], len(header['keys']))
+  if mmap and shape[0]:
+    frames = np.memmap(file_path, dtype=header['dtype'], mode='r',
+                       offset=header['offset'], shape=shape)
+  else:
+    with open(file_path, 'rb') as f:
+      f.seek(header['offset'])
+      frames = np.fromfile(f, dtype=header['dtype'], count=shape[0] * shape[1])
+    frames = frames.reshape(shape)
+  return header, frames
+
+
+#################
+## Frame Store ##
+#################
+
+class FrameStore:
+  '''
+  On-disk analysis results of one recording, kept under media/out/{uuid}/ as
+  two complex64 frame files:
+
+  - {uuid}.X_k.frames : X_k at every frame, (frames, keys)
+  - {uuid}.x_n.frames : x_n at every frame, (frames, 1)
+
+  x_n is the same for every key (see SDFT.reconstruct_frames), so only its
+  first column is stored and the x_n property broadcasts it back to (frames,
+  keys). Both are memory mapped read-only when opened, so reading a time slice
+  only touches the pages holding it.
+  '''
+
+  NAMES = ('X_k', 'x_n')
+
+  def __init__(self, directory, uuid):
+    self.directory = directory
+    self.uuid = uuid
+    self.headers = {}
+    self.arrays = {}
+
+  def path(self, name):
+    return os.path.join(self.directory, f'{self.uuid}.{name}.frames')
+
+  def exists(self):
+    return all(os.path.exists(self.path(name)) for name in self.NAMES)
+
+  @classmethod
+  def save(cls, directory, uuid, X_k, x_n, play_rate, sample_rate, keys=None):
+    '''
+    Writes a frame store and returns it
+
+    ### Parameters
+    - X_k, x_n : (frames, keys) arrays, stored as complex64, of x_n only the
+      first column is kept
+    '''
+    os.makedirs(directory, exist_ok=True)
+    store = cls(directory, uuid)
+    x_n = np.asarray(x_n)[:, :1]
+    for name, frames, columns in ((cls.NAMES[0], X_k, keys), (cls.NAMES[1], x_n, None)):
+      # Write next to the final path so readers never see a partial file
+      tmp_path = store.path(name) + '.tmp'
+      write_frames(tmp_path, frames, play_rate, sample_rate, keys=columns, dtype='<c8')
+      os.replace(tmp_path, store.path(name))
+    return store
+
+  def open(self, name):
+    if name not in self.arrays:
+      self.headers[name], self.arrays[name] = read_frames(self.path(name), mmap=True)
+    return self.arrays[name]
+
+  @property
+  def X_k(self):
+    return self.open('X_k')
+
+  @property
+  def x_n(self):
+    return np.broadcast_to(self.open('x_n'), (len(self), len(self.keys)))
+
+  @property
+  def header(self):
+    self.open('X_k')
+    return self.headers['X_k']
+
+  @property
+  def play_rate(self):
+    return float(self.header['play_rate'])
+
+  @property
+  def sample_rate(self):
+    return int(self.header['sample_rate'])
+
+  @property
+  def keys(self):
+    return self.header['keys']
+
+  def __len__(self):
+    return self.header['frames']
+
+  def frame_range(self, start=0, stop=None):
+    '''Returns the slice of frames starting within [start, stop) seconds'''
+    first = max(0, int(np.ceil(start * self.play_rate)))
+    last = len(self) if stop is None else min(len(self), int(np.ceil(stop * self.play_rate)))
+    return slice(first, max(first, last))
+
+  def read(self, start=0, stop=None, name='X_k'):
+    '''Returns the frames starting within [start, stop) seconds, as a view'''
+    return getattr(self, name)[self.frame_range(start, stop)]
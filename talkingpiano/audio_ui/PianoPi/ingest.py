@@ -0,0 +1,148 @@
+'''
+Streaming wav ingestion.
+
+A WavSource memory maps a wav file and hands out mono float64 samples one
+slice at a time, selecting or downmixing channels per slice. The frame, stft
+and bank engines only ever slice their input, so analyzing a WavSource keeps
+at most a block of samples in memory however long the recording is. Anything
+that needs the whole signal at once (the sdft and block engines, the
+parallel engine) converts it with np.asarray.
+'''
+
+#############
+## Imports ##
+#############
+
+from scipy.io import wavfile
+from scipy.signal import firwin, upfirdn
+import numpy as np
+
+
+###############
+## Constants ##
+###############
+
+# Samples per block yielded by WavSource.blocks
+INGEST_BLOCK = 1 << 16
+
+# Anti-aliasing filter taps per unit of decimation factor, see DecimatedSource
+DECIMATION_TAPS = 20
+
+
+def read_wav(file_path, mmap=True):
+  '''
+  Returns the sample rate and samples of a wav file, memory mapped unless
+  the format can't be (e.g 24 bit PCM), in which case it is read whole
+  '''
+  if mmap:
+    try:
+      return wavfile.read(file_path, mmap=True)
+    except ValueError:
+      pass
+  return wavfile.read(file_path)
+
+
+class WavSource:
+  '''
+  Mono, float64 view of a wav file that reads only the samples sliced from it
+
+  ### Example
+    source = WavSource(file_path)
+    len(source), source[48000:96000], np.asarray(source)
+  '''
+
+  def __init__(self, file_path, channel=0, block_size=INGEST_BLOCK, mmap=True):
+    '''
+    ### Parameters
+    - channel : Index of the channel to analyze, or None to average all of
+      them
+    - block_size : Samples per block yielded by blocks()
+    '''
+    self.file_path = file_path
+    self.sample_rate, self.data = read_wav(file_path, mmap)
+    self.channels = 1 if self.data.ndim == 1 else self.data.shape[1]
+    if channel is not None and not -self.channels <= channel < self.channels:
+      raise ValueError(f'{file_path} has {self.channels} channels, no channel {channel}')
+    self.channel = channel
+    self.block_size = block_size
+
+  def __len__(self):
+    return len(self.data)
+
+  def mono(self, samples):
+    '''Selects or downmixes the channels of a slice of self.data'''
+    if self.channels == 1 and samples.ndim == 1:
+      return samples.astype(float)
+    if self.channel is None:
+      return samples.mean(axis=-1, dtype=float)
+    return samples[..., self.channel].astype(float)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice) and index.step not in (None, 1):
+      raise IndexError('WavSource only supports contiguous slices')
+    return self.mono(self.data[index])
+
+  def blocks(self, start=0, stop=None):
+    '''Yields the samples in [start, stop) block_size samples at a time'''
+    stop = len(self) if stop is None else min(stop, len(self))
+    for i in range(start, stop, self.block_size):
+      yield self[i:min(i + self.block_size, stop)]
+
+  def __array__(self, dtype=None, copy=None):
+    '''Reads every sample, block by block'''
+    x = np.empty(len(self), dtype=float)
+    for i, block in zip(range(0, len(self), self.block_size), self.blocks()):
+      x[i:i + len(block)] = block
+    return x if dtype is None else x.astype(dtype, copy=False)
+
+
+class DecimatedSource:
+  '''
+  Anti-aliased view of a source of samples at 1/q of its sample rate, sliced
+  like the source itself
+
+  Output sample m is the low pass filtered input at sample m*q. The filter is
+  a linear phase FIR with its cutoff at the new Nyquist frequency, centered on
+  m*q so nothing is delayed, and every slice only filters the input samples
+  it needs, so the source is never read whole.
+  '''
+
+  def __init__(self, source, q, taps=DECIMATION_TAPS):
+    '''
+    ### Parameters
+    - source : Array or sliceable source of samples, e.g a WavSource
+    - q : Decimation factor
+    - taps : Filter length in units of q
+    '''
+    self.source = source
+    self.q = q
+    self.h = firwin(taps * q + 1, 1 / q)
+    # Half the filter length, a whole number of input samples
+    self.delay = taps * q // 2
+
+  def __len__(self):
+    return -(-len(self.source) // self.q)
+
+  def __getitem__(self, index):
+    if not isinstance(index, slice) or index.step not in (None, 1):
+      raise IndexError('DecimatedSource only supports contiguous slices')
+    start, stop, _ = index.indices(len(self))
+    stop = max(start, stop)
+
+    # Input samples [low, high) feed outputs [start, stop), zero outside
+    q, D = self.q, self.delay
+    low = start * q - D
+    high = max(low, (stop - 1) * q + D + 1)
+    segment = np.asarray(self.source[max(low, 0):min(high, len(self.source))], dtype=float)
+    left = max(0, -low)
+    segment = np.concatenate((np.zeros(left), segment,
+                              np.zeros(high - low - left - len(segment))))
+
+    # Output i of upfirdn is centered on segment[i*q - D], i.e on input
+    # sample low + i*q - D, which is start*q for i = 2D/q
+    first = 2 * D // q
+    return upfirdn(self.h, segment, 1, q)[first:first + stop - start]
+
+  def __array__(self, dtype=None, copy=None):
+    x = self[0:len(self)]
+    return x if dtype is None else x.astype(dtype, copy=False)
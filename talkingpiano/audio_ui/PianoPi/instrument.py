@@ -0,0 +1,91 @@
+'''
+Stage timings and counters for the PianoPi pipeline.
+
+Instrumentation is opt-in: everything takes a Stats object or None, and with
+None the only cost is an `is None` check per stage, never per sample.
+
+Example
+
+  stats = Stats(callback=lambda name, seconds, stats: print(name, seconds))
+  piano = PianoPi(file_path, stats=stats)
+  piano.stats.report()
+'''
+
+#############
+## Imports ##
+#############
+
+from contextlib import contextmanager, nullcontext
+import functools
+import os
+import time
+
+
+################
+## Statistics ##
+################
+
+class Stats:
+  '''
+  Durations of each pipeline stage and counters such as samples processed,
+  frames emitted and bytes written
+  '''
+
+  def __init__(self, callback=None):
+    '''
+    ### Parameters
+    - callback : Optional callback(name, seconds, stats) called as every stage
+      finishes
+    '''
+    self.callback = callback
+    self.stages = {}
+    self.counters = {}
+
+  @contextmanager
+  def stage(self, name):
+    '''Times the enclosed block, repeated stages add up'''
+    start = time.perf_counter()
+    try:
+      yield self
+    finally:
+      seconds = time.perf_counter() - start
+      self.stages[name] = self.stages.get(name, 0) + seconds
+      if self.callback is not None:
+        self.callback(name, seconds, self)
+
+  def count(self, name, n=1):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def count_file(self, file_path):
+    '''Counts the size of a file that was just written as bytes_written'''
+    self.count('bytes_written', os.path.getsize(file_path))
+
+  def report(self):
+    '''
+    Returns the stage durations (in seconds) and counters as plain dicts.
+    Stages nest, e.g generate_output includes analyze, so they don't add up.
+    '''
+    return {
+      'stages' : dict(self.stages),
+      'counters' : dict(self.counters),
+    }
+
+
+# Shared do-nothing context for when instrumentation is off
+NO_STAGE = nullcontext()
+
+def stage(stats, name):
+  '''Times a stage on stats, or does nothing if stats is None'''
+  return NO_STAGE if stats is None else stats.stage(name)
+
+def timed(name):
+  '''Decorator timing a method as a stage on its instance's stats, if any'''
+  def decorator(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+      if self.stats is None:
+        return method(self, *args, **kwargs)
+      with self.stats.stage(name):
+        return method(self, *args, **kwargs)
+    return wrapper
+  return decorator
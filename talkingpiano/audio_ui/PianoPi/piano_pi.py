@@ -14,17 +14,21 @@ Contact: aceamarco@gmail.com / macea@andrew.cmu.edu
 ## Imports ##
 #############
 
-from .SDFT import SDFTBin, PLAY_RATE, SAMPLE_RATE, MAGNITUDE_MAX
-from multiprocessing import Process, Value, Array
-from scipy.io import wavfile
+from .SDFT import analyze, reconstruct_frames, SDFTBank, PLAY_RATE, SAMPLE_RATE, MAGNITUDE_MAX, DEFAULT_ENGINE, SMA_WINDOW
 from .dbg import *
+from .instrument import stage, timed
+from .frames import write_frames, FrameStore
+from .result_cache import content_key
+from .ingest import WavSource
+from functools import cached_property
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
 import getopt
 import uuid
-import csv
+import wave
+import json
 
 import plotly.graph_objects as go
 import plotly.express as px
@@ -39,6 +43,9 @@ import pandas as pd
 GAIN = 10
 THRESHOLD = 0.05
 
+# Rows formatted per write when generating the tsv
+TSV_ROW_BLOCK = 1024
+
 # Audio Reconstruction
 # TODO: See comment below
 '''
@@ -47,6 +54,15 @@ to every note, from what I understand each note has a varying decay
 '''
 DECAY_EXP = 0.0001
 
+# Frames resynthesized per write to the output wav file
+WAV_CHUNK_FRAMES = 256
+
+# Most samples drawn in the reconstructed audio plot
+PLOT_POINTS = 200000
+
+# Most frames (columns) in a heatmap payload, longer recordings are decimated
+HEATMAP_FRAMES = 1000
+
 # Frequencies corresponding to each piano key
 PIANO_KEY_FREQUENCIES = []
 
@@ -73,48 +89,288 @@ f.close()
 # for i, key_freq in enumerate(PIANO_KEY_FREQUENCIES):
 #   TSV_HEADERS.append(f'key{i}_{key_freq}Hz')
 
-class PianoPi:
+def key_indices(keys=None):
+  '''
+  Returns the sorted piano key indices (0-87) a key selection stands for
+
+  ### Parameters
+  - keys : None for every key, piano key indices (e.g range(19, 88) for keys
+    20 through 88) or a boolean mask over all 88 keys
+  '''
+  if keys is None:
+    return np.arange(len(PIANO_KEY_FREQUENCIES))
+
+  keys = np.asarray(keys)
+  if keys.dtype == bool:
+    if keys.shape != (len(PIANO_KEY_FREQUENCIES),):
+      raise ValueError(f'Key mask must have {len(PIANO_KEY_FREQUENCIES)} entries, not {keys.shape}')
+    keys = np.flatnonzero(keys)
+  keys = np.unique(keys.astype(int))
+
+  if len(keys) == 0:
+    raise ValueError('No piano keys selected')
+  if keys[0] < 0 or keys[-1] >= len(PIANO_KEY_FREQUENCIES):
+    raise ValueError(f'Piano key indices must be within 0-{len(PIANO_KEY_FREQUENCIES) - 1}')
+  return keys
+
+# Bump whenever the outputs change for the same inputs, invalidates every
+# cached result
+RESULT_VERSION = 3
+
+def cache_key(file_path, play_rate=PLAY_RATE, backend=DEFAULT_ENGINE, channel=0,
+              decimate=False, keys=None, digest=None):
+  '''
+  Returns the result cache key of a recording, a hash of its bytes and every
+  parameter that changes what PianoPi writes for it (see result_cache)
+
+  ### Parameters
+  - digest : result_cache.file_digest of the recording if already known,
+    skips hashing it
+  '''
+  return content_key(file_path, {
+    'version' : RESULT_VERSION,
+    'play_rate' : play_rate,
+    'backend' : backend,
+    'channel' : channel,
+    'decimate' : decimate,
+    'key_frequencies' : PIANO_KEY_FREQUENCIES,
+    'keys' : key_indices(keys).tolist(),
+    'sma_window' : SMA_WINDOW,
+    'gain' : GAIN,
+    'threshold' : THRESHOLD,
+    'decay_exp' : DECAY_EXP,
+  }, digest=digest)
 
-  def __init__(self, file_path, uuid = uuid.uuid4(), play_rate=PLAY_RATE):
+class PianoPi:
+  '''
+  Analysis of one recording. Nothing is read or computed up front, every
+  result below is computed the first time it is used and then kept, so each
+  caller only pays for what it asks for, e.g the note matrix never computes
+  the reconstructed audio:
+
+  - audio_time_series, sample_rate : The recording, memory mapped on first use
+  - key_freq_through_time(_T) : X_k of every active key, (keys, frames) and
+    its (frames, keys) transpose
+  - reconstructed_audio(_T) : x_n of every active key, only needed for the wav
+    output
+  - piano_note_matrix : See generate_piano_note_matrix
+  - tsv_path, frames_path, output_wav_path, heatmap_paths, frame_store : The
+    files written by the matching generate_* / save_frames method
+
+  Only the active keys (self.keys) are analyzed, every keys axis above holds
+  one of them per column, in the order of self.keys. The frame files and the
+  tsv header record the same mapping.
+
+  The generate_* methods recompute and rewrite their output every call, except
+  generate_heatmap(s), which return the payloads already written unless
+  overwrite is set.
+  '''
+
+  def __init__(self, file_path, uuid = uuid.uuid4(), play_rate=PLAY_RATE,
+               backend=DEFAULT_ENGINE, workers=1, channel=0, decimate=False,
+               keys=None, stats=None):
+    '''
+    ### Parameters
+    - backend : The SDFT engine used for the analysis, see SDFT.ENGINES
+    - channel : Channel of the recording to analyze, None averages them all
+    - keys : The piano keys to analyze, see key_indices, e.g
+      scheduler.SCHEDULER_KEYS for the keys the scheduler plays. Every other
+      key is never analyzed nor written. Defaults to all 88.
+    - decimate : Analyze the recording at the lowest sample rate that covers
+      the highest key, see SDFT.decimation_factor. Faster, but frames no
+      longer match PianoPiStream exactly, so it is opt in
+    - workers : Number of processes the keys are spread across
+    - stats : Optional instrument.Stats, records how long every stage took and
+      what it processed, see self.report()
+    '''
     self.file_path = file_path
-    self.sample_rate, self.audio_time_series = wavfile.read(self.file_path)
-    if len(np.shape(self.audio_time_series)) != 1:
-      self.audio_time_series = self.audio_time_series[:,0]
-    dbg_print(np.shape(self.audio_time_series))
+    self.stats = stats
     self.play_rate = play_rate
-    self.sample_window = self.sample_rate // play_rate
     self.uuid = uuid
+    self.backend = backend
+    self.workers = workers
+    self.channel = channel
+    self.decimate = decimate
+    self.keys = key_indices(keys)
+    self.key_frequencies = [PIANO_KEY_FREQUENCIES[key] for key in self.keys]
+
+  @classmethod
+  def from_store(cls, uuid, file_path=None, stats=None):
+    '''
+    Reopens the analysis saved by save_frames without recomputing it, X_k and
+    x_n are memory mapped from media/out/{uuid}/
 
-    self.generate_output()
+    ### Parameters
+    - file_path : The original recording, only read if the wav output is
+      regenerated
 
-  
-  def generate_output(self):
+    ### Returns
+    PianoPi backed by the frame store, or None if nothing was saved for uuid
+    '''
+    store = FrameStore(f'media/out/{uuid}', uuid)
+    if not store.exists():
+      return None
+
+    self = cls(file_path, uuid=uuid, play_rate=store.play_rate, backend=None,
+               keys=store.keys, stats=stats)
+    self.frame_store = store
+    self.sample_rate = store.sample_rate
+    if file_path is None:
+      self.audio_len = len(store) * self.sample_window
+
+    # Frames by keys on disk, keys by frames views for the rest of the class
+    self.key_freq_through_time_T = store.X_k
+    self.reconstructed_audio_T = store.x_n
+    self.key_freq_through_time = self.key_freq_through_time_T.T
+    self.reconstructed_audio = self.reconstructed_audio_T.T
+
+    return self
+
+  ###########
+  ## Audio ##
+  ###########
+
+  def read_audio(self):
+    '''
+    Opens the recording as a memory mapped ingest.WavSource, analyzing its
+    first channel. The engines read it a block at a time.
+    '''
+    with stage(self.stats, 'wavfile.read'):
+      audio = WavSource(self.file_path, channel=self.channel)
+    dbg_print(len(audio), audio.channels)
+    return audio.sample_rate, audio
+
+  @cached_property
+  def audio_time_series(self):
+    sample_rate, audio = self.read_audio()
+    self.__dict__.setdefault('sample_rate', sample_rate)
+    return audio
+
+  @cached_property
+  def sample_rate(self):
+    sample_rate, self.audio_time_series = self.read_audio()
+    return sample_rate
+
+  @cached_property
+  def audio(self):
+    return self.audio_time_series
+
+  @cached_property
+  def audio_len(self):
+    return len(self.audio_time_series)
+
+  @cached_property
+  def sample_window(self):
+    return int(self.sample_rate // self.play_rate)
+
+  ##############
+  ## Analysis ##
+  ##############
+
+  def run_analysis(self, reconstruct):
+    '''
+    X_k[n] (and x[n] if reconstruct) for every active key, one row per key,
+    with the keys spread across self.workers processes
+    '''
     # Preconditions
-    dbg_assert(PIANO_KEY_FREQUENCIES)
+    dbg_assert(self.key_frequencies)
+    dbg_print(self.audio_len)
 
-    self.audio_len = len(self.audio_time_series)
-    self.audio = self.audio_time_series
-    self.sign = (self.audio_time_series / np.abs(self.audio_time_series)).astype(int)
+    X_k, x_n = analyze(
+      self.audio_time_series, self.key_frequencies, self.sample_rate,
+      self.play_rate, engine=self.backend, workers=self.workers,
+      reconstruct=reconstruct, decimate=self.decimate, stats=self.stats)
+    dbg_assert(len(X_k) == len(self.keys))
+    return X_k, x_n
+
+  @cached_property
+  def key_freq_through_time(self):
+    return self.run_analysis(reconstruct=False)[0]
+
+  @cached_property
+  def key_freq_through_time_T(self):
+    return np.transpose(self.key_freq_through_time)
+
+  @cached_property
+  def reconstructed_audio(self):
+    # x_n does not depend on X_k, see SDFT.reconstruct_frames
+    with stage(self.stats, 'reconstruct'):
+      return reconstruct_frames(self.audio_time_series, len(self.keys),
+                                self.sample_window)
+
+  @cached_property
+  def reconstructed_audio_T(self):
+    return np.transpose(self.reconstructed_audio)
+
+  @cached_property
+  def piano_note_matrix(self):
+    return self.generate_piano_note_matrix()
+
+  ###############
+  ## Artifacts ##
+  ###############
+
+  @cached_property
+  def tsv_path(self):
+    return self.generate_tsv()
+
+  @cached_property
+  def frames_path(self):
+    return self.generate_frames()
+
+  @cached_property
+  def output_wav_path(self):
+    return self.generate_output_wav_file()
+
+  @cached_property
+  def heatmap_paths(self):
+    return self.generate_heatmaps()
+
+  @cached_property
+  def frame_store(self):
+    return self.save_frames()
+
+  @timed('save_frames')
+  def save_frames(self):
+    '''
+    Saves X_k and x_n to a frame store under media/out/{uuid}/ (see
+    frames.FrameStore) so from_store, getArray and the scheduler can reopen
+    them later
 
-    dbg_print(self.audio_len)
+    ### Returns
+    - store : The FrameStore written
+    '''
+    store = FrameStore.save(f'media/out/{self.uuid}', self.uuid,
+                            self.key_freq_through_time_T,
+                            self.reconstructed_audio_T,
+                            self.play_rate, self.sample_rate, keys=self.keys)
+    for name in FrameStore.NAMES:
+      self.count_file(store.path(name))
+
+    self.frame_store = store
+    return store
 
-    self.SDFTBins = [SDFTBin(freq, self.sample_rate) for freq in PIANO_KEY_FREQUENCIES]
-    self.key_freq_through_time = [[] for i in range(len(PIANO_KEY_FREQUENCIES))]
-    self.reconstructed_audio = [[] for i in range(len(PIANO_KEY_FREQUENCIES))]
-    dbg_assert(len(self.key_freq_through_time) == len(self.SDFTBins))
+  def report(self):
+    '''Returns the stage timings and counters, or None if not instrumented'''
+    return None if self.stats is None else self.stats.report()
 
-    # # TODO: Parrallelize this code block
-    for i, bin in enumerate(self.SDFTBins):
-      dbg_print(f'Parsing audio file for key {i+1}')
-      X_k, x_n = bin.parse(self.audio_time_series)
-      self.key_freq_through_time[i] = X_k # X_k[n] for this specific key
-      self.reconstructed_audio[i] = x_n # x[n] for this specific key
+  def count_file(self, file_path):
+    if self.stats is not None:
+      self.stats.count_file(file_path)
+
+  @timed('generate_output')
+  def generate_output(self):
+    '''Runs the whole analysis now, X_k and x_n of every key in one pass of the
+    engine, instead of on first use'''
+    self.key_freq_through_time, self.reconstructed_audio = self.run_analysis(
+      reconstruct=True)
 
-    # # Also generate transposed versions of both matrices
-    self.key_freq_through_time_T = np.transpose(self.key_freq_through_time)
-    self.reconstructed_audio_T = np.transpose(self.reconstructed_audio)
+    # Transposed versions of both matrices follow on their next use
+    self.__dict__.pop('key_freq_through_time_T', None)
+    self.__dict__.pop('reconstructed_audio_T', None)
 
 
+  @timed('plot_freq_through_time')
   def plot_freq_through_time(self):
     dbg_assert(self.key_freq_through_time_T)
     dbg_assert(self.audio_len)
@@ -129,9 +385,9 @@ class PianoPi:
 
     for n in range(len(self.key_freq_through_time_T)):
       freqs_at_n = np.abs(self.key_freq_through_time_T[n])
-      D["Y"].extend(PIANO_KEY_FREQUENCIES)
+      D["Y"].extend(self.key_frequencies)
       D["Z"].extend(freqs_at_n)
-      D["X"].extend(np.full(len(PIANO_KEY_FREQUENCIES), n * (1/self.play_rate)))
+      D["X"].extend(np.full(len(self.keys), n * (1/self.play_rate)))
       D["color"].extend([n]*len(freqs_at_n))
 
     # tight layout
@@ -154,11 +410,97 @@ class PianoPi:
     file_path = file_path + f'/{self.uuid}_3d_frequencies.html'
 
     fig.write_html(file_path)
+    self.count_file(file_path)
     
     if (DEBUG): 
       fig.show()
 
 
+  def heatmap_path(self, name):
+    '''Returns media/out/{uuid}/plots/json/{uuid}_{name}.json, creating the
+    directory'''
+    file_path = f'media/out/{self.uuid}/plots/json'
+
+    if not os.path.exists(file_path):
+      os.makedirs(file_path)
+    return file_path + f'/{self.uuid}_{name}.json'
+
+  @timed('generate_heatmap')
+  def generate_heatmap(self, name, matrix, title, z_label,
+                       max_frames=HEATMAP_FRAMES, overwrite=False):
+    '''
+    Writes the magnitude of a (frames, keys) matrix as a heatmap payload for
+    heatmap.js, media/out/{uuid}/plots/json/{uuid}_{name}.json
+
+    ### Parameters
+    - max_frames : Longer matrices keep the largest value of every run of
+      ceil(frames / max_frames) frames, None keeps every frame
+    - overwrite : Rewrite the payload even if it was already generated
+
+    ### Returns
+    - file_path : Path of the payload
+    '''
+    file_path = self.heatmap_path(name)
+
+    # One payload per analysis
+    if os.path.exists(file_path) and not overwrite:
+      return file_path
+
+    power = np.abs(matrix)
+    frames = len(power)
+    step = 1 if not max_frames else max(1, -(-frames // max_frames))
+    if step > 1:
+      padded = np.zeros((-(-frames // step) * step, power.shape[1]), power.dtype)
+      padded[:frames] = power
+      power = padded.reshape(-1, step, power.shape[1]).max(axis=1)
+
+    payload = {
+      'title' : title,
+      'x' : np.round(np.arange(len(power)) * step / self.play_rate, 3).tolist(),
+      'y' : self.key_frequencies,
+      'z' : np.round(power.T, 4).tolist(),
+      'labels' : {
+        'x' : 'Time t [s]',
+        'y' : 'Frequency \u03C9 [Hz]',
+        'z' : z_label,
+      },
+      'step' : step,
+    }
+
+    # Write next to the final path so the page never reads a partial payload
+    with open(file_path + '.tmp', 'w') as out_file:
+      json.dump(payload, out_file, separators=(',', ':'))
+    os.replace(file_path + '.tmp', file_path)
+    self.count_file(file_path)
+
+    return file_path
+
+  def generate_heatmaps(self, overwrite=False):
+    '''
+    Writes the payloads drawn on the record page, the key magnitudes and the
+    piano note matrix, unless they were already generated
+
+    ### Returns
+    - file_paths : Paths of both payloads
+    '''
+    file_paths = [
+      self.generate_heatmap('frequencies', self.key_freq_through_time_T,
+                            'Change in Frequencies Through Time Using the SDFT',
+                            'Amplitude', overwrite=overwrite),
+    ]
+
+    # Skip the note matrix when its payload is already cached
+    notes_path = self.heatmap_path('piano_notes')
+    if overwrite or not os.path.exists(notes_path):
+      notes_path = self.generate_heatmap('piano_notes',
+                                         self.piano_note_matrix,
+                                         'Piano Notes', 'Piano Note Strength',
+                                         overwrite=overwrite)
+    file_paths.append(notes_path)
+
+    return file_paths
+
+  @timed('generate_output_wav_file')
   def generate_output_wav_file(self):
     '''
     Generates an output wav file and plot using the piano using the reconstructed
@@ -169,31 +511,23 @@ class PianoPi:
     Wav files require a minimum sample rate of 3000 Hz, and our ears require the
     audio from the reconstructed samples to persist for some time — because of
     this, we're multiplying the signal at time p by a decaying exponential that
-    will carry the sound into the next time sample'''
+    will carry the sound into the next time sample
+
+    ### Returns
+    - file_path : Path of the wav file'''
 
     ######################################
     ## Build Reconstructed Audio Signal ##
     ######################################
 
-    x_n = []
-
-    for n in range(len(self.reconstructed_audio_T)):
-      audio_at_n = self.reconstructed_audio_T[n]
-
-      diff = ((n+1) * self.sample_window) - (self.audio.size)
-
-      if diff > 0:
-        n_range = np.arange(self.sample_window - diff)
-      else:
-        n_range = np.arange(self.sample_window)
+    # Every frame holds the same decay, scaled by the magnitude of the sum of
+    # x_n over all keys at that frame, and takes its sign from the input audio
+    decay = np.exp(-1*np.arange(self.sample_window) * DECAY_EXP)
+    frames = len(self.reconstructed_audio_T)
 
-      decay = np.exp(-1*n_range * DECAY_EXP)
-      A = np.sum(audio_at_n)
-      
-      x_n.extend(A*decay)
-
-    Y = np.abs(x_n) * self.sign
-    X = np.arange(0, len(Y)*(1/self.play_rate), (1/self.play_rate))
+    # Only every plot_step-th sample is kept for the plot
+    plot_step = max(1, len(self.audio) // PLOT_POINTS)
+    plot_Y = []
 
     ########################
     ## Generate .wav file ##
@@ -206,12 +540,32 @@ class PianoPi:
       os.makedirs(file_path)
     file_path = file_path + f'/{self.uuid}.wav'
 
-    wavfile.write(file_path, self.sample_rate, Y.astype(np.int16))
+    with wave.open(file_path, 'wb') as out_file:
+      out_file.setnchannels(1)
+      out_file.setsampwidth(2)
+      out_file.setframerate(self.sample_rate)
+
+      # WAV_CHUNK_FRAMES frames at a time, the last frame stops with the audio
+      for start in range(0, frames, WAV_CHUNK_FRAMES):
+        stop = min(start + WAV_CHUNK_FRAMES, frames)
+        A = np.abs(np.sum(self.reconstructed_audio_T[start:stop], axis=1))
+        Y = np.outer(A, decay).ravel()
+
+        audio = self.audio[start * self.sample_window : stop * self.sample_window]
+        Y = Y[:len(audio)] * np.sign(audio)
+        out_file.writeframes(Y.astype('<i2').tobytes())
+        plot_Y.append(Y[(-start * self.sample_window) % plot_step::plot_step])
+
+    self.count_file(file_path)
+    wav_path = file_path
 
     ##########################################
     ## Generate plot of reconstructed audio ##
     ##########################################
 
+    Y = np.concatenate(plot_Y) if plot_Y else np.zeros(0)
+    X = np.arange(len(Y)) * plot_step / self.sample_rate
+
     fig = plt.figure()
     ax = fig.add_subplot()
 
@@ -228,14 +582,43 @@ class PianoPi:
     file_path = file_path + f'/{self.uuid}_reconstructed_audio.png'
 
     plt.savefig(file_path)
+    self.count_file(file_path)
 
     if (DEBUG) :
       plt.show()
+    plt.close(fig)
+
+    return wav_path
 
 
+  def key_percentages(self, amplitude=MAGNITUDE_MAX):
+    '''Returns the (frames, keys) matrix of key magnitudes as a percentage of
+    amplitude, the values written to the tsv and frame files'''
+    return 100 * np.abs(self.key_freq_through_time_T) / amplitude
+
+  def time_stamps_ms(self, frames):
+    '''Returns the time stamp (ms) of the first frames frames'''
+    return np.round(np.arange(frames) * (1 / self.play_rate) * 1000)
+
+  def output_path(self, extension):
+    '''Returns media/out/{uuid}/{uuid}.{extension}, creating the directory'''
+    file_path = f'media/out/{self.uuid}'
+
+    if not os.path.exists(file_path):
+      os.makedirs(file_path)
+    return file_path + f'/{self.uuid}.{extension}'
+
+  @timed('generate_tsv')
   def generate_tsv(self, amplitude=MAGNITUDE_MAX):
     '''Generates a text file containing what keys to play, returns unique id
-    for given recording.'''
+    for given recording. The tsv is an export only, the scheduler reads this
+    PianoPi or its frame store directly (see scheduler.read_source).
+
+    The first line is a '#' header naming the columns, time_ms and then the
+    piano key index (0-87) of every active key. Every other row is a frame,
+    the time stamp in ms followed by the magnitude of every active key as a
+    percentage of amplitude. Rows are formatted and written TSV_ROW_BLOCK at a
+    time.'''
 
     # Preconditions
     dbg_assert(self.key_freq_through_time_T)
@@ -244,65 +627,80 @@ class PianoPi:
     dbg_assert(self.sample_window)
 
     # Generate a unique id for this audio recording
-    file_path = f'media/out/{self.uuid}'
+    file_path = self.output_path('tsv')
 
-    if not os.path.exists(file_path):
-      os.makedirs(file_path)
-    file_path = file_path + f'/{self.uuid}.tsv'
+    values = self.key_percentages(amplitude)
+    time_stamps = self.time_stamps_ms(len(values))
+    row_format = '%d' + '\t%.2f' * values.shape[1] + '\r\n'
 
     # Create the text file named {uuid}.tsv
-    with open(file_path,'wt') as out_file:
-      # Write the column headers
-      tsv_writer = csv.writer(out_file, delimiter='\t')
-      #tsv_writer.writerow(TSV_HEADERS)
+    with open(file_path, 'w', newline='') as out_file:
+      out_file.write('#time_ms' + ''.join(f'\t{key}' for key in self.keys) + '\r\n')
+      for start in range(0, len(values), TSV_ROW_BLOCK):
+        block = np.column_stack((time_stamps[start:start + TSV_ROW_BLOCK],
+                                 values[start:start + TSV_ROW_BLOCK]))
+        out_file.write((row_format * len(block)) % tuple(block.ravel()))
+
+    self.count_file(file_path)
 
-      # Iterate through every play rate sample
-      for i in range(len(self.key_freq_through_time_T[0])):
-        time_stamp_ms = round(i * (1 / self.play_rate) * 1000)
-        tsv_row = [f'{time_stamp_ms}']
-        for key in self.key_freq_through_time_T:
-          tsv_row.append('{0:.2f}'.format((100*(np.abs(key[i]) / amplitude))))
-        tsv_writer.writerow(tsv_row)
+    return file_path
+
+  @timed('generate_frames')
+  def generate_frames(self, amplitude=MAGNITUDE_MAX):
+    '''
+    Generates media/out/{uuid}/{uuid}.frames, a binary sibling of the tsv
+    holding the same percentages as float32 (see frames.py for the layout).
+    scheduler.parse_input reads either file.
 
-    out_file.close()
+    ### Returns
+    - file_path : Path of the frame file
+    '''
+    file_path = self.output_path('frames')
+    write_frames(file_path, self.key_percentages(amplitude), self.play_rate,
+                 self.sample_rate, keys=self.keys)
+    self.count_file(file_path)
 
     return file_path
 
-  def generate_piano_note_matrix(self):
+  @timed('generate_piano_note_matrix')
+  def generate_piano_note_matrix(self, plot=False):
     '''
     Generates a matrix representing what piano keys to press using a naive
     filtering algorithm that will not press a key unless the power at that key
     is higher than at the previous timestamp
+
+    ### Parameters
+    - plot : Also write the piano note plot, see plot_piano_note_matrix
+
+    ### Returns
+    (frames, keys) array holding the strength of every key press, 0 elsewhere
     '''
 
     dbg_assert(self.key_freq_through_time_T)
 
-    if len(self.key_freq_through_time_T) < 2:
+    power = np.abs(self.key_freq_through_time_T)
+    if len(power) < 2:
       # Not enough samples to play piano notes
-      return []
+      return np.zeros((0, len(self.keys)))
 
-    res = [[0 for j in range(len(self.key_freq_through_time_T[i]))] for i in range(len(self.key_freq_through_time_T))]
-    dbg_assert(np.shape(res) == np.shape(self.key_freq_through_time_T))
+    max_amplitude = np.amax(power)
+    strength = np.divide(power, max_amplitude, out=np.zeros_like(power),
+                         where=max_amplitude > 0)
 
-    max_amplitude = np.amax(np.abs(self.key_freq_through_time_T))
-    
-    for n in range(1, len(self.key_freq_through_time_T)):
-      for k in range(len(self.key_freq_through_time_T[n])):
-        prev_power = np.abs(self.key_freq_through_time_T[n-1][k])
-        curr_power = np.abs(self.key_freq_through_time_T[n][k])
-
-        if (curr_power > prev_power):
-          # Reset strength
-          strength = curr_power / max_amplitude
-          if (strength > THRESHOLD):
-            res[n][k] = strength
+    # Press a key when its power rose since the previous timestamp and is
+    # strong enough, the first timestamp never presses
+    res = np.zeros_like(power)
+    pressed = (power[1:] > power[:-1]) & (strength[1:] > THRESHOLD)
+    res[1:][pressed] = strength[1:][pressed]
 
-    self.plot_piano_note_matrix(res)
+    if plot:
+      self.plot_piano_note_matrix(res)
 
     dbg_print(np.shape(res))
 
     return res
 
+  @timed('plot_piano_note_matrix')
   def plot_piano_note_matrix(self, matrix):
     dbg_assert(self.key_freq_through_time_T)
     dbg_assert(self.audio_len)
@@ -317,9 +715,9 @@ class PianoPi:
 
     for n in range(len(matrix)):
       freqs_at_n = np.abs(matrix[n])
-      D["Y"].extend(PIANO_KEY_FREQUENCIES)
+      D["Y"].extend(self.key_frequencies)
       D["Z"].extend(freqs_at_n)
-      D["X"].extend(np.full(len(PIANO_KEY_FREQUENCIES), n * (1/self.play_rate)))
+      D["X"].extend(np.full(len(self.keys), n * (1/self.play_rate)))
       D["color"].extend([n]*len(freqs_at_n))
 
     # tight layout
@@ -342,6 +740,59 @@ class PianoPi:
     file_path = file_path + f'/{self.uuid}_piano_notes.html'
 
     fig.write_html(file_path)
+    self.count_file(file_path)
     
     if (DEBUG): 
-      fig.show()
\ No newline at end of file
+      fig.show()
+
+
+class PianoPiStream:
+  '''
+  Streaming counterpart of PianoPi for live audio.
+
+  Audio is fed in chunks of any size, the SDFT state is kept between chunks,
+  and every 1/play_rate s frame of key magnitudes is handed back as soon as the
+  chunk containing its last sample has been fed. The stream always runs at the
+  full sample rate, so frame i matches np.abs(PianoPi.key_freq_through_time_T[i])
+  on the same audio for a PianoPi with decimate=False, the default.
+  '''
+
+  def __init__(self, sample_rate=SAMPLE_RATE, play_rate=PLAY_RATE, keys=None):
+    '''
+    ### Parameters
+    - keys : The piano keys to analyze, see key_indices
+    '''
+    self.sample_rate = sample_rate
+    self.play_rate = play_rate
+    self.keys = key_indices(keys)
+    self.bank = SDFTBank([PIANO_KEY_FREQUENCIES[key] for key in self.keys],
+                         sample_rate, play_rate)
+    self.frames = 0
+
+  def feed(self, chunk):
+    '''
+    Advances the analysis by a chunk of samples
+
+    ### Parameters
+    - chunk : The next samples of the recording, stereo chunks use channel 0
+      like PianoPi does
+
+    ### Returns
+    - An iterator over the |X_k| of every active key, one array per frame completed
+      by this chunk
+    '''
+    if len(np.shape(chunk)) != 1:
+      chunk = np.asarray(chunk)[:,0]
+
+    X_k, _ = self.bank.process(chunk)
+    self.frames += len(X_k)
+    return (np.abs(frame) for frame in X_k)
+
+  def time_stamp_ms(self, frame):
+    '''Returns the time stamp of a frame, as written to the tsv'''
+    return round(frame * (1 / self.play_rate) * 1000)
+
+  def reset(self):
+    '''Starts a new recording'''
+    self.bank.reset()
+    self.frames = 0
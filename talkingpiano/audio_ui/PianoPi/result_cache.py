@@ -0,0 +1,184 @@
+'''
+Content-addressed cache of analysis results.
+
+Every entry is the media/out/{key}/ directory PianoPi writes its outputs to,
+where key hashes the recording's bytes together with every parameter that
+changes the analysis (see piano_pi.cache_key). An unchanged recording, or the
+same recording uploaded twice, maps to the same entry and is served from it.
+
+An entry is complete once it holds ENTRY_FILE, a small JSON file listing the
+records (refs) using it. The file's modification time is the entry's last use,
+and the least recently used entries are deleted once the cache outgrows
+max_bytes. An entry is also deleted when its last record is.
+'''
+
+#############
+## Imports ##
+#############
+
+import hashlib
+import json
+import os
+import re
+import shutil
+
+
+###############
+## Constants ##
+###############
+
+RESULT_DIR = 'media/out'
+RESULT_CACHE_BYTES = 1 << 30
+ENTRY_FILE = '.cache.json'
+
+# Bytes hashed per read of the recording
+HASH_BLOCK = 1 << 20
+
+KEY_PATTERN = re.compile('[0-9a-f]{40}')
+
+
+def file_digest(file_path):
+  '''Returns the sha1 of the file's bytes, read HASH_BLOCK bytes at a time'''
+  h = hashlib.sha1()
+  with open(file_path, 'rb') as f:
+    for block in iter(lambda: f.read(HASH_BLOCK), b''):
+      h.update(block)
+  return h.hexdigest()
+
+def content_key(file_path, params, digest=None):
+  '''
+  Returns the sha1 of the file's digest and params
+
+  ### Parameters
+  - params : JSON serializable parameters of the analysis
+  - digest : The file_digest of the file if already known, e.g stored with
+    the record, so the file isn't read again
+  '''
+  if digest is None:
+    digest = file_digest(file_path)
+  h = hashlib.sha1(digest.encode())
+  h.update(json.dumps(params, sort_keys=True).encode())
+  return h.hexdigest()
+
+
+class ResultCache:
+
+  def __init__(self, directory=RESULT_DIR, max_bytes=RESULT_CACHE_BYTES):
+    self.directory = directory
+    self.max_bytes = max_bytes
+
+  @staticmethod
+  def is_key(key):
+    return isinstance(key, str) and KEY_PATTERN.fullmatch(key) is not None
+
+  def path(self, key):
+    if not self.is_key(key):
+      raise ValueError(f'Invalid result cache key {key!r}')
+    return os.path.join(self.directory, key)
+
+  def entry_path(self, key):
+    return os.path.join(self.path(key), ENTRY_FILE)
+
+  def keys(self):
+    '''Keys of every entry on disk, complete or not'''
+    if not os.path.isdir(self.directory):
+      return []
+    return [name for name in os.listdir(self.directory) if self.is_key(name)]
+
+  def refs(self, key):
+    try:
+      with open(self.entry_path(key)) as f:
+        return json.load(f)['refs']
+    except (OSError, ValueError, KeyError):
+      return []
+
+  def write_refs(self, key, refs):
+    # Replaced atomically, so a reader never sees a partial entry file
+    tmp_path = self.entry_path(key) + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'refs' : sorted(set(refs))}, f)
+    os.replace(tmp_path, self.entry_path(key))
+
+  def lookup(self, key):
+    '''Returns whether key has a complete entry, marking it as just used'''
+    try:
+      os.utime(self.entry_path(key))
+      return True
+    except OSError:
+      return False
+
+  def add(self, key, ref=None):
+    '''
+    Marks the outputs written under path(key) as a complete entry used by
+    ref, then evicts least recently used entries down to max_bytes
+    '''
+    refs = self.refs(key)
+    if ref is not None and ref not in refs:
+      refs.append(ref)
+    self.write_refs(key, refs)
+    self.evict(keep=(key,))
+
+  def remove(self, key):
+    shutil.rmtree(self.path(key), ignore_errors=True)
+
+  def release(self, ref):
+    '''
+    Drops ref from every entry, deleting the entries no record uses anymore
+
+    ### Returns
+    - keys : The entries deleted
+    '''
+    removed = []
+    for key in self.keys():
+      refs = self.refs(key)
+      if ref not in refs:
+        continue
+      refs.remove(ref)
+      if refs:
+        self.write_refs(key, refs)
+      else:
+        self.remove(key)
+        removed.append(key)
+    return removed
+
+  def size(self, key):
+    total = 0
+    for root, _, files in os.walk(self.path(key)):
+      for name in files:
+        try:
+          total += os.path.getsize(os.path.join(root, name))
+        except OSError:
+          pass
+    return total
+
+  def last_used(self, key):
+    '''Last use of an entry, None for entries still being written'''
+    try:
+      return os.path.getmtime(self.entry_path(key))
+    except OSError:
+      return None
+
+  def evict(self, keep=()):
+    '''
+    Deletes least recently used entries, never the ones in keep, until the
+    cache holds at most max_bytes. Entries still being written (no ENTRY_FILE
+    yet) count towards the size but are never deleted, another request is
+    filling them.
+
+    ### Returns
+    - keys : The entries deleted
+    '''
+    sizes = {key : self.size(key) for key in self.keys()}
+    total = sum(sizes.values())
+    last_used = {key : self.last_used(key) for key in sizes}
+    complete = [key for key in sizes if last_used[key] is not None]
+    removed = []
+    for key in sorted(complete, key=last_used.get):
+      if total <= self.max_bytes:
+        break
+      if key in keep:
+        continue
+      self.remove(key)
+      total -= sizes[key]
+      removed.append(key)
+    return removed
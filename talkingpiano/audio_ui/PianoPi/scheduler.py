@@ -1,5 +1,10 @@
-import math
+from collections import namedtuple
+import os
 import sys
+import numpy as np
+from .events import VELOCITY_LEVELS, encode, iter_frames
+from .frames import FRAME_MAGIC, FrameStore, read_frames
+from .SDFT import MAGNITUDE_MAX
 # class note:
 #     def __init__ (self, freq, amp):
 #         self.freq = freq # index of the key with 0 <= freq <= 68
@@ -16,34 +21,92 @@ import sys
 
 # Most operations done on the data are in-place and destructive
 
-def parse_input(filename):
-    #parses the input file into a 2D list
-    file = open(filename, "r")
-    threshold = 8
-    data = []
-    for line in file:
-        temp = [entry.rstrip() for entry in line.split()]
-        temp2 = []
-        for item in temp:
-            # print("HAHAHAHAHHA")
-            # print(item)
-            # print(type(item))
-            val = float(item)
-            if val >= threshold:
-                temp2.append(val/100) 
-            elif val < threshold:
-                temp2.append(0)
-        # data.append(int(item)) for item in temp
-        data.append(temp2)
-        dataMax = find_max_amp(data)
-
-        for sampleNum in range(len(data)):
-          for noteNum in range(len(data[sampleNum])):
-            if(data[sampleNum][noteNum] > 0):
-              data[sampleNum][noteNum] = data[sampleNum][noteNum]/dataMax
-            
-              
-    return data
+# piano key indices (0-87) the solenoids drive, keys 20 thru 88. Column i of
+# the parsed data and of the performance is key SCHEDULER_KEYS[i - 1], column
+# 0 being the time stamp
+SCHEDULER_KEYS = range(19, 88)
+
+# key percentages below this are silence
+THRESHOLD = 8
+
+def select_keys(values, file_keys, keys):
+    # the columns of values (one per key in file_keys) for every key in keys,
+    # 0 for keys the file doesn't have
+    positions = {key: i for i, key in enumerate(file_keys)}
+    selected = np.zeros((len(values), len(keys)), dtype=values.dtype)
+    for i, key in enumerate(keys):
+        if key in positions:
+            selected[:, i] = values[:, positions[key]]
+    return selected
+
+def read_tsv(filename):
+    # reads a tsv written by PianoPi.generate_tsv in one go, returns the time
+    # stamps (ms), the percentages and the key of every column. a headerless
+    # tsv holds keys 0, 1...
+    with open(filename, "r") as file:
+        header = file.readline().split()
+    rows = np.loadtxt(filename, comments="#", ndmin=2)
+    if header and header[0].startswith("#"):
+        file_keys = [int(key) for key in header[1:]]
+    else:
+        file_keys = range(max(0, rows.shape[1] - 1))
+    if rows.size == 0:
+        rows = np.zeros((0, len(file_keys) + 1))
+    return rows[:, 0], rows[:, 1:], file_keys
+
+def time_stamps_ms(frames, play_rate):
+    # time stamp (ms) of every frame, as written to the tsv
+    return np.round(np.arange(frames) * (1 / play_rate) * 1000)
+
+def read_matrix(filename, keys=SCHEDULER_KEYS):
+    # reads a tsv or binary .frames file, returns the time stamp (ms) of every
+    # frame and a (frames, keys) array of the percentage of every key in keys.
+    # files name their columns (the tsv's '#' header, the .frames header)
+    with open(filename, "rb") as file:
+        binary = file.read(len(FRAME_MAGIC)) == FRAME_MAGIC
+
+    if not binary:
+        time_stamps, values, file_keys = read_tsv(filename)
+        return time_stamps, select_keys(values, file_keys, keys)
+
+    # percentages are stored as is, the frame store's X_k as complex64
+    header, frames = read_frames(filename, mmap=True)
+    time_stamps = time_stamps_ms(len(frames), header["play_rate"])
+    values = select_keys(frames, header["keys"].tolist(), keys)
+    if header["dtype"].kind == "c":
+        values = 100 * np.abs(values) / MAGNITUDE_MAX
+    return time_stamps, values
+
+def read_source(source, keys=SCHEDULER_KEYS):
+    # read_matrix for any source: a tsv or .frames file name, or straight
+    # from memory, a PianoPi (its key_freq_through_time_T) or a
+    # frames.FrameStore (its memory mapped X_k). only the columns of keys
+    # are ever converted
+    if isinstance(source, (str, os.PathLike)):
+        return read_matrix(source, keys)
+
+    if isinstance(source, FrameStore):
+        X_k = source.X_k
+    else:
+        X_k = source.key_freq_through_time_T
+    values = select_keys(X_k, list(source.keys), keys)
+    time_stamps = time_stamps_ms(len(values), source.play_rate)
+    return time_stamps, 100 * np.abs(values) / MAGNITUDE_MAX
+
+def normalize(time_stamps, percentages, threshold=THRESHOLD):
+    # parsed data: the time stamp column (ms) then one column per key, keys
+    # under threshold percent silenced and the rest scaled so the loudest
+    # key of the recording is 1
+    volumes = np.where(percentages >= threshold, percentages / 100, 0.0)
+    loudest = volumes.max(initial=0)
+    if loudest > 0:
+        volumes /= loudest
+    return np.column_stack((time_stamps, volumes))
+
+def parse_input(source, keys=SCHEDULER_KEYS, threshold=THRESHOLD):
+    #parses the input (see read_source) in one pass into a (frames, keys + 1)
+    #array, see normalize
+    return normalize(*read_source(source, keys), threshold)
 
 def find_max_amp(performance_data):
     # a lot of loops but it's only run once
@@ -77,10 +140,12 @@ def find_max_amp(performance_data):
 
 # def track_note_length (hold_arr, curr_index, )
 
-def estimate_volume(hold_arr, og_vol, key_index, fade_param = -.2):
+def estimate_volume(hold_arr, og_vol, key_index=slice(None), fade_param = -.2):
+    # estimated volume of a key, or of every key at once with the default
+    # key_index. og_vol is the volume the key was last pressed at
     note_length = hold_arr[key_index]
     # print(og_vol)
-    curr_vol = math.e**(og_vol[key_index]*fade_param)
+    curr_vol = np.exp(np.asarray(og_vol)[key_index]*fade_param)
     return curr_vol
 
 def separate_syllables (note0, note1, max_volume = 5):
@@ -89,108 +154,179 @@ def separate_syllables (note0, note1, max_volume = 5):
     # difference = 2 # tweak with this param; must not exceed max_volume
     return (note1 if (abs(note0 - note1) > difference) else 0)
 
-# much opportunity to optimize if we need to use C or other lower level
-# language
-def data_to_performance (data, performance, hold_arr, initial_volumes):
-    # first time stamp
-    performance[0] = data[0]
-    i = 0
-    #set flags in hold array and set initial volumes
-    for key in performance[0]:
-        if key:
-            hold_arr[i]+=1
-            initial_volumes[i] = key
-        i+=1
+# what a performance holds for a key at every frame: the volume it is
+# (re)pressed at, LIFT when it is released, 0 to leave it as is
+LIFT = -1
+
+def performance_step(curr_vol, hold_arr, initial_volumes, fade_param = -.2):
+    # decides press, hold or lift for every key at once for one frame of
+    # volumes. hold_arr (frames each key has been pressed for) and
+    # initial_volumes (volume each key was last pressed at) are numpy state
+    # vectors updated in place. returns the performance row of the frame
+    estimated_vol = estimate_volume(hold_arr, initial_volumes, fade_param=fade_param)
+    sounding = curr_vol != 0
+
+    # a key that isn't pressed has nothing left to decay
+    decayed = (hold_arr == 0) | (estimated_vol == 0)
+
+    # RE-PRESS: the key completely decayed or is not loud enough
+    press = sounding & (decayed | (estimated_vol < curr_vol))
+    # STAY PRESSED
+    keep = sounding & ~press
+    # LIFT: currently playing but need quiet, everything else stays unpressed
+    lift = ~sounding & (hold_arr != 0)
+
+    row = np.where(press, curr_vol, 0.0)
+    row[lift] = LIFT
+
+    initial_volumes[press] = curr_vol[press]
+    hold_arr[press] = 1
+    hold_arr[keep] += 1
+    hold_arr[lift] = 0
+    return row
+
+def data_to_performance (data, hold_arr = None, initial_volumes = None, fade_param = -.2):
+    # turns parsed data (the time stamp column then one column per key) into
+    # a performance of the same shape: the time stamps, then at every frame
+    # the volume of every key press, LIFT for every release and 0 elsewhere.
+    # every frame decides all keys at once, see performance_step. pass the
+    # hold_arr and initial_volumes (one entry per key) of a previous call to
+    # continue it, they're updated in place
+    data = np.asarray(data, dtype=float)
+    performance = np.zeros_like(data)
+    if len(data) == 0:
+        return performance
+
+    volumes = data[:, 1:]
+    performance[:, 0] = data[:, 0]
+    start = 0
+
+    if hold_arr is None:
+        hold_arr = np.zeros(volumes.shape[1], dtype=int)
+        initial_volumes = np.zeros(volumes.shape[1])
+
+        # first time stamp, press everything sounding
+        first = volumes[0] != 0
+        performance[0, 1:] = volumes[0]
+        hold_arr[first] += 1
+        initial_volumes[first] = volumes[0][first]
+        start = 1
 
     # get projected volumes for each key and compare to speech volume
-    for time in range(1, len(data)):
-        for key_index in range(1, 69):
-
-            prev_vol = data[time-1][key_index]
-            curr_vol = data[time][key_index]
-            # print(curr_vol)
-            # print(curr_vol)
-            # note1 = separate_syllables(note0, note1)
-            estimated_vol = estimate_volume(hold_arr, initial_volumes, key_index)
-
-            if estimated_vol:
-                if (curr_vol):
-                    if estimated_vol < curr_vol:
-                        #RE-PRESS
-                        # not loud enough, need repress
-                        performance[time][key_index] = curr_vol
-                        initial_volumes[key_index] = curr_vol
-                        hold_arr[key_index] = 1
-                    
-                    elif estimated_vol >= curr_vol:
-                        #keep
-                        #STAY PRESSED
-                        performance[time][key_index] = 0
-                        hold_arr[key_index]+=1
-
-                elif (not curr_vol):
-                    if hold_arr[key_index] != 0:
-                        #LIFT
-                        #currently playing
-                        performance[time][key_index] = -1
-                        hold_arr[key_index] = 0
-                    elif hold_arr[key_index] == 0:
-                        #STAY UNPRESSED
-                        #not currently playing
-                        performance[time][key_index] = 0 
-
-            elif (not estimated_vol):
-                if (curr_vol):
-                    if hold_arr[key_index]:
-                        #completely decayed, being pressed, need to repress
-                        performance[time][key_index] = curr_vol
-                        initial_volumes[key_index] = curr_vol
-                        hold_arr[key_index] = 1
-
-                    elif (not hold_arr[key_index]):
-                        #completely decayed, not pressed, need to repress
-                        performance[time][key_index] = curr_vol
-                        initial_volumes[key_index] = curr_vol
-                        hold_arr[key_index] = 1
-
-                elif (not curr_vol):
-                    if hold_arr[key_index]:
-                        #decayed, being pressed, but need quiet
-                        performance[time][key_index] = -1
-                        hold_arr = 0
-
-                    elif (not hold_arr[key_index]):
-                        #decayed, not pressed, need quiet
-                        performance[time][key_index] = 0 
-                        #no need to update hold_arr
-
+    for time in range(start, len(data)):
+        performance[time, 1:] = performance_step(volumes[time], hold_arr,
+                                                 initial_volumes, fade_param)
 
     return performance
 
+def performance_events(performance, keys=SCHEDULER_KEYS):
+    # the sparse events (frame, key, action, velocity) of a performance, see
+    # events.py. a performance is nearly all zeros, this is what gets stored
+    # and sent to the player instead of the dense matrix
+    return encode(np.asarray(performance)[:, 1:], keys)
+
+def play_events(events, callback):
+    # the player side: calls callback(frame, key, action, volume) for every
+    # event, frame by frame. volume is 0-1 for presses and 0 for lifts
+    for frame, group in iter_frames(events):
+        for _, key, action, velocity in group.tolist():
+            callback(frame, key, action, velocity / VELOCITY_LEVELS)
+
+# a command for one key, action "press" (at volume), "hold" (leave it down)
+# or "lift". key is the piano key index (0-87), volume is 0 unless pressing
+Command = namedtuple("Command", ["action", "key", "volume"])
+
+class Scheduler:
+    # frame by frame scheduler for live audio, e.g behind a PianoPiStream:
+    #
+    #   stream = PianoPiStream(keys=SCHEDULER_KEYS)
+    #   scheduler = Scheduler()
+    #   for frame in stream.feed(chunk):
+    #       for command in scheduler.step(frame):
+    #           ...
+    #
+    # every frame is decided like data_to_performance decides it, as soon as
+    # it comes in. the volumes are normalized by max_volume if given, else by
+    # the loudest volume seen so far instead of the loudest of the recording
+
+    def __init__(self, keys=SCHEDULER_KEYS, frame_keys=None, max_volume=None,
+                 threshold=THRESHOLD, fade_param=-.2):
+        # keys: piano key indices to play
+        # frame_keys: piano key index of every column of the frames stepped,
+        #   defaults to keys
+        # max_volume: volume (|X_k| / MAGNITUDE_MAX) that plays at full
+        #   strength, louder frames are capped at 1. None tracks a running max
+        self.keys = list(keys)
+        self.frame_keys = self.keys if frame_keys is None else list(frame_keys)
+        self.max_volume = max_volume
+        self.threshold = threshold
+        self.fade_param = fade_param
+        self.reset()
+
+    def reset(self):
+        # starts a new recording, every key lifted
+        self.frames = 0
+        self.loudest = 0
+        self.hold_arr = np.zeros(len(self.keys), dtype=int)
+        self.initial_volumes = np.zeros(len(self.keys))
+
+    def volumes(self, frame):
+        # the normalized volume of every key in a frame of key magnitudes
+        magnitudes = select_keys(np.abs(np.asarray(frame))[None], self.frame_keys, self.keys)[0]
+        percentages = 100 * magnitudes / MAGNITUDE_MAX
+        volumes = np.where(percentages >= self.threshold, percentages / 100, 0.0)
+
+        if self.max_volume is not None:
+            return np.minimum(volumes / self.max_volume, 1)
+        self.loudest = max(self.loudest, volumes.max(initial=0))
+        return volumes / self.loudest if self.loudest > 0 else volumes
+
+    def step(self, frame):
+        # consumes one frame of key magnitudes (|X_k| of every frame_keys
+        # column, e.g from PianoPiStream.feed) and yields its commands, a
+        # press for every key pressed, and a hold or lift only for keys that
+        # were already pressed. the frame is applied right away, so skipping
+        # its commands doesn't hold the scheduler back
+        curr_vol = self.volumes(frame)
+        sounding = curr_vol != 0
+        held = self.hold_arr != 0
+
+        if self.frames == 0:
+            # first time stamp, press everything sounding
+            row = curr_vol.copy()
+            self.hold_arr[sounding] += 1
+            self.initial_volumes[sounding] = curr_vol[sounding]
+        else:
+            row = performance_step(curr_vol, self.hold_arr, self.initial_volumes,
+                                   self.fade_param)
+        self.frames += 1
+
+        return self.commands(row, held, sounding)
+
+    def commands(self, row, held, sounding):
+        # the commands of one performance row, keys in order
+        for i in np.flatnonzero((row > 0) | held):
+            if row[i] > 0:
+                yield Command("press", self.keys[i], float(row[i]))
+            elif row[i] == LIFT:
+                yield Command("lift", self.keys[i], 0.0)
+            elif sounding[i]:
+                yield Command("hold", self.keys[i], 0.0)
+
 #TODO & to test
 #multidimensional distance
 #total amplitude summation (try different averages)
 #number of total keys changed
 
-def init(input_file):
-    # global hold_arr
-    hold_arr = [0] * 69
-
-    # global initial_volumes
-    initial_volumes = [0] * 69
+def init(source, keys=SCHEDULER_KEYS):
+    # source is a PianoPi, a frames.FrameStore or a tsv / .frames file name,
+    # the first two are handed over without writing or parsing any file
 
     # global data
-    data = parse_input(input_file)
-
-    max_map = find_max_amp(data)
-    speech_time = len(data)
+    data = parse_input(source, keys)
 
-    # global performance
-    performance = [[0] * 69 for i in range(speech_time)]
-
-    
-    initial_volumes = data[0]
-    performance = data_to_performance(data, performance, hold_arr, initial_volumes)
+    # global performance, hold_arr and initial_volumes start empty
+    performance = data_to_performance(data)
 
     print(performance)
     return performance
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_ui', '0002_record_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='digest',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
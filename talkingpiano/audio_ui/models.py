@@ -3,6 +3,8 @@ import uuid
 from django.db import models
 from django.urls.base import reverse
 
+from .PianoPi.result_cache import ResultCache, file_digest
+
 # Create your models here.
 
 #Record model that holds data of a voice recording and allows for storage
@@ -11,6 +13,8 @@ class Record(models.Model):
   id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
   voice = models.FileField(upload_to="records")
   name = models.CharField(max_length=50, default="")
+  # sha1 of the recording, see voice_digest
+  digest = models.CharField(max_length=40, blank=True, default="")
 
   class Meta:
     verbose_name = "Record"
@@ -22,7 +26,16 @@ class Record(models.Model):
   def get_absolute_url(self):
     return reverse("record_detail", kwargs={"id":str(self.id)})
 
+  def voice_digest(self):
+    # Hashes the recording once, on first use, rather than on every view
+    if not self.digest:
+      self.digest = file_digest(self.voice.path)
+      self.save(update_fields=["digest"])
+    return self.digest
+
   def delete(self, *args, **kwargs):
+    # Cached analysis outputs no other record shares
+    ResultCache().release(str(self.id))
     self.voice.delete()
     super().delete(*args, **kwargs)
 
@@ -0,0 +1,40 @@
+/*
+  heatmap.js draws the key-through-time heatmaps of a record from the JSON
+  payloads written by PianoPi.generate_heatmap, using plotly.js in the browser
+
+  Payload: {title, x (frame times [s]), y (key frequencies [Hz]),
+            z (keys x frames), labels: {x, y, z}, step (frames per column)}
+*/
+
+
+//Fetches the payload at url and draws it as a heatmap inside element id
+function drawHeatmap(id, url){
+  fetch(url)
+    .then((response) => {
+      if (!response.ok) {
+        throw new Error(response.status + " " + url);
+      }
+      return response.json();
+    })
+    .then((data) => {
+      let trace = {
+        type: "heatmap",
+        x: data.x,
+        y: data.y,
+        z: data.z,
+        colorscale: "Viridis",
+        colorbar: {title: data.labels.z},
+        hovertemplate: "%{x:.2f} s<br>%{y:.1f} Hz<br>%{z}<extra></extra>",
+      };
+      let layout = {
+        title: data.title,
+        xaxis: {title: data.labels.x},
+        yaxis: {title: data.labels.y, type: "log"},
+      };
+      Plotly.newPlot(id, [trace], layout, {responsive: true});
+    })
+    .catch((error) => {
+      console.log(error);
+      document.getElementById(id).textContent = "Plot unavailable";
+    });
+}
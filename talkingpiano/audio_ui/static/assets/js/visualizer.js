@@ -448,20 +448,24 @@ function getCookie(name) {
 
 
 //AJAX call to retrieve input list from views.py
-//Triggers playDelayedNotes once note array is retrieved
+//Triggers playEvents once the note events are retrieved
 function getArray(){
   let arr;
   $.ajax({
     url: "getArray",
     type: "POST",
     dataType: "json",
+    data: {
+      // Key of the cached analysis of this record, see record_detail
+      uuid: document.getElementById("analysisKey").value,
+    },
     headers: {
       "X-Requested-With": "XMLHttpRequest",
       "X-CSRFToken": getCookie("csrftoken"),  // don't forget to include the 'getCookie' function
     },
     success: (data) => {
       console.log(data.data);
-      playDelayedNotes(data.data, 0);
+      playEvents(data.data);
     },
     error: (error) => {
       console.log(error);
@@ -471,26 +475,31 @@ function getArray(){
 }
 
 
-//Loops through each note in array and calls playNote on each
-function playArray(arr){
-  var arrayLength = arr.length
-  if(arrayLength > 69){
-    arrayLength = 69
-  }
-  for(let note = 0; note < arrayLength; note++){
-    if(arr[note] != 0){
-      console.log("playing array index");
-      //playNote(note, arr[note]);
-      playNote(note, .2);
+//Plays the sparse note events from getArray, see PianoPi/events.py
+//Payload: {play_rate, frames, keys, levels,
+//          events: [frame delta, key, action, velocity, ...]}
+//Every event is scheduled once instead of scanning every key of every frame
+function playEvents(data){
+  let frameDelay = 1000 / data.play_rate; //time delay (ms) between each frame
+  let frame = 0;
+  for(let i = 0; i < data.events.length; i += 4){
+    frame += data.events[i];
+    let key = data.events[i + 1];
+    let action = data.events[i + 2];
+    let velocity = data.events[i + 3] / data.levels;
+    //Only the first 69 keys are drawn
+    if(key >= 69){
+      continue;
     }
-  }
-}
-
-
-function playDelayedNotes(arr, index){
-  if((index < arr.length)){
-    playArray(arr[index]);
-    setTimeout(() => {playDelayedNotes(arr, index+1)}, sampleDelay);
+    setTimeout(() => {
+      if(action == -1){
+        playNote(key, -1);
+      }
+      else{
+        //playNote(key, velocity);
+        playNote(key, .2);
+      }
+    }, frame * frameDelay);
   }
 }
 
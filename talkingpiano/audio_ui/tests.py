@@ -1,3 +1,358 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+import math
+import numpy as np
+import os
+import tempfile
+
+from .PianoPi import events, scheduler
+from .PianoPi.frames import read_frames, read_header, write_frames
+from .PianoPi.piano_pi import PIANO_KEY_FREQUENCIES, PianoPi, PianoPiStream
+from .PianoPi.SDFT import BIN_PLAN_DIR, ENGINES, BinPlan, SDFTBin, analyze, decimation_factor
+from .PianoPi.ingest import DecimatedSource, WavSource
+from .PianoPi.result_cache import ResultCache
 
 # Create your tests here.
+
+def reference_performance(data, fade_param=-.2):
+  '''
+  The original per-key loop of scheduler.data_to_performance, with the
+  hold_arr bug fixed, keys that aren't held treated as completely decayed and
+  the time stamp column passed through
+  '''
+  keys = len(data[0])
+  performance = [[0] * keys for _ in data]
+  hold_arr = [0] * keys
+  initial_volumes = [0] * keys
+
+  performance[0] = list(data[0])
+  for key_index in range(1, keys):
+    if data[0][key_index]:
+      hold_arr[key_index] += 1
+      initial_volumes[key_index] = data[0][key_index]
+
+  for time in range(1, len(data)):
+    performance[time][0] = data[time][0]
+    for key_index in range(1, keys):
+      curr_vol = data[time][key_index]
+      estimated_vol = math.e**(initial_volumes[key_index]*fade_param) if hold_arr[key_index] else 0
+      if curr_vol and (not estimated_vol or estimated_vol < curr_vol):
+        performance[time][key_index] = curr_vol
+        initial_volumes[key_index] = curr_vol
+        hold_arr[key_index] = 1
+      elif curr_vol:
+        hold_arr[key_index] += 1
+      elif hold_arr[key_index]:
+        performance[time][key_index] = -1
+        hold_arr[key_index] = 0
+
+  return performance
+
+def brute_force_N_k(note_frequency, sample_rate, play_rate=15):
+  '''The original window size search of SDFTBin.find_N_k, returns (N, k)'''
+  N_min = float('inf')
+  error_min = float('inf')
+  for N_i in range(1, sample_rate // play_rate):
+    error = note_frequency % (sample_rate / N_i)
+    if error < error_min:
+      N_min = N_i
+      error_min = error
+  effective_frequency = note_frequency - error_min
+  return N_min, int(effective_frequency // (sample_rate // N_min))
+
+
+class PerformanceTests(SimpleTestCase):
+
+  def test_golden_performance(self):
+    data = [
+      [0, 0.5, 0, 0],
+      [67, 0.95, 0.3, 0],
+      [133, 0, 0, 0],
+      [200, 0.9, 0, 1.0],
+    ]
+    expected = [
+      [0, 0.5, 0, 0],       # press the sounding key
+      [67, 0.95, 0.3, 0],   # re-press above exp(-0.2 * 0.5), press b
+      [133, -1, -1, 0],     # lift both held keys
+      [200, 0.9, 0, 1.0],   # a and c aren't held, press them
+    ]
+    np.testing.assert_allclose(scheduler.data_to_performance(data), expected)
+
+  def test_matches_reference_loop(self):
+    rng = np.random.default_rng(0)
+    data = rng.random((200, len(scheduler.SCHEDULER_KEYS) + 1))
+    data[rng.random(data.shape) < 0.5] = 0
+    data[:, 0] = np.arange(len(data)) * 67
+    np.testing.assert_allclose(scheduler.data_to_performance(data),
+                               reference_performance(data.tolist()))
+
+  def test_state_carries_over(self):
+    data = np.array([[0, 0.9], [67, 0], [133, 0.95]])
+    first = scheduler.data_to_performance(data[:1])
+    hold_arr, initial_volumes = np.array([1]), np.array([0.9])
+    rest = scheduler.data_to_performance(data[1:], hold_arr, initial_volumes)
+    np.testing.assert_allclose(np.concatenate((first, rest)),
+                               scheduler.data_to_performance(data))
+    np.testing.assert_allclose(rest, [[67, -1], [133, 0.95]])
+    np.testing.assert_array_equal(hold_arr, [1])
+
+
+class SchedulerTests(SimpleTestCase):
+
+  def test_matches_data_to_performance(self):
+    rng = np.random.default_rng(1)
+    magnitudes = rng.random((100, 3)) * scheduler.MAGNITUDE_MAX / 4
+    data = scheduler.normalize(np.arange(100) * 67, 100 * magnitudes / scheduler.MAGNITUDE_MAX)
+    performance = scheduler.data_to_performance(data)
+
+    # With the recording's loudest volume configured, every frame is decided
+    # exactly like the batch scheduler decides it
+    live = scheduler.Scheduler(keys=[40, 41, 42],
+                               max_volume=magnitudes.max() / scheduler.MAGNITUDE_MAX)
+    for frame, row in zip(magnitudes, performance[:, 1:]):
+      commands = [command for command in live.step(frame) if command.action != 'hold']
+      self.assertEqual([command.key - 40 for command in commands], list(np.flatnonzero(row)))
+      np.testing.assert_allclose([command.volume if command.action == 'press' else -1
+                                  for command in commands], row[row != 0])
+
+  def test_running_max(self):
+    live = scheduler.Scheduler(keys=[0, 1])
+    frames = np.array([[0.1, 0], [0, 0.4], [0.2, 0]]) * scheduler.MAGNITUDE_MAX
+    self.assertEqual(list(live.step(frames[0])), [scheduler.Command('press', 0, 1.0)])
+    self.assertEqual(list(live.step(frames[1])), [scheduler.Command('lift', 0, 0.0),
+                                                  scheduler.Command('press', 1, 1.0)])
+    # 0.2 of a running max of 0.4
+    self.assertEqual(list(live.step(frames[2])), [scheduler.Command('press', 0, 0.5),
+                                                  scheduler.Command('lift', 1, 0.0)])
+    # Still under key 0's estimate of exp(-0.2 * 0.5)
+    self.assertEqual(list(live.step(frames[2])), [scheduler.Command('hold', 0, 0.0)])
+
+  def test_holds_and_lifts_only_pressed_keys(self):
+    rng = np.random.default_rng(2)
+    magnitudes = rng.random((200, 4)) * scheduler.MAGNITUDE_MAX / 4
+    magnitudes[rng.random(magnitudes.shape) < 0.5] = 0
+    live = scheduler.Scheduler(keys=range(4))
+
+    pressed = set()
+    for frame in magnitudes:
+      for command in live.step(frame):
+        if command.action == 'press':
+          pressed.add(command.key)
+        else:
+          self.assertIn(command.key, pressed)
+          if command.action == 'lift':
+            pressed.remove(command.key)
+
+class EngineTests(SimpleTestCase):
+
+  def test_engines_match_sdft_bin(self):
+    # Half a second of a recorded C4 and a few keys around it
+    source = WavSource(os.path.join(os.path.dirname(__file__), '..', 'media',
+                                    'records', 'C4vH.wav'))
+    x = source[:source.sample_rate // 2]
+    keys = [130.813, 261.626, 277.183, 523.251, 1046.502]
+
+    reference = [SDFTBin(key, source.sample_rate, 15).parse(x) for key in keys]
+    X_k = np.array([X for X, _ in reference])
+    x_n = np.array([x for _, x in reference])
+
+    for engine in ('bank', 'block', 'frame'):
+      with self.subTest(engine=engine):
+        engine_X_k, engine_x_n = ENGINES[engine](x, keys, source.sample_rate, 15)
+        np.testing.assert_allclose(engine_X_k, X_k, rtol=0, atol=1e-9 * np.abs(X_k).max())
+        np.testing.assert_allclose(engine_x_n, x_n, rtol=0, atol=1e-9 * np.abs(x_n).max())
+
+
+class BinPlanTests(SimpleTestCase):
+
+  def test_matches_brute_force_search(self):
+    for sample_rate in (48000, 44100):
+      plan = BinPlan(PIANO_KEY_FREQUENCIES, sample_rate, 15)
+      expected = [brute_force_N_k(f, sample_rate) for f in PIANO_KEY_FREQUENCIES]
+      with self.subTest(sample_rate=sample_rate):
+        self.assertEqual(list(zip(plan.N.tolist(), plan.k.tolist())), expected)
+
+  def test_get_saves_and_loads(self):
+    plans, cwd = dict(BinPlan.plans), os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+      # BIN_PLAN_DIR is relative to the working directory
+      os.chdir(directory)
+      try:
+        BinPlan.plans.clear()
+        computed = BinPlan.get(PIANO_KEY_FREQUENCIES, 44100, 15)
+        self.assertIs(BinPlan.get(PIANO_KEY_FREQUENCIES, 44100, 15), computed)
+        self.assertEqual(len(os.listdir(BIN_PLAN_DIR)), 1)
+
+        # A fresh process only finds the saved file
+        BinPlan.plans.clear()
+        loaded = BinPlan.get(PIANO_KEY_FREQUENCIES, 44100, 15)
+      finally:
+        os.chdir(cwd)
+        BinPlan.plans.clear()
+        BinPlan.plans.update(plans)
+
+    self.assertIsNot(loaded, computed)
+    for name in ('N', 'k', 'effective_frequency', 'effective_bandwidth', 'error'):
+      np.testing.assert_array_equal(getattr(loaded, name), getattr(computed, name))
+
+
+class DecimationTests(SimpleTestCase):
+
+  def setUp(self):
+    source = WavSource(os.path.join(os.path.dirname(__file__), '..', 'media',
+                                    'records', 'C4vH.wav'))
+    self.sample_rate = source.sample_rate
+    self.x = np.asarray(source[:len(source)], dtype=float)
+    self.q = decimation_factor(PIANO_KEY_FREQUENCIES, self.sample_rate, 15)
+
+  def test_slices_match_whole(self):
+    self.assertEqual(self.q, 4)
+    decimated = DecimatedSource(self.x, self.q)
+    whole = np.asarray(decimated)
+    self.assertEqual(len(whole), -(-len(self.x) // self.q))
+
+    rng = np.random.default_rng(6)
+    for start, stop in np.sort(rng.integers(0, len(whole) + 1, (50, 2))):
+      np.testing.assert_allclose(decimated[start:stop], whole[start:stop],
+                                 rtol=0, atol=1e-12 * np.abs(whole).max())
+
+  def test_matches_undecimated(self):
+    plan = BinPlan(PIANO_KEY_FREQUENCIES, self.sample_rate, 15)
+    decimated_plan = plan.decimated(self.q)
+    np.testing.assert_array_equal(decimated_plan.effective_frequency, plan.effective_frequency)
+    np.testing.assert_allclose(decimated_plan.bin_frequency, plan.bin_frequency, rtol=0.02)
+
+    full, _ = analyze(self.x, PIANO_KEY_FREQUENCIES, self.sample_rate, 15, reconstruct=False)
+    decimated, _ = analyze(self.x, PIANO_KEY_FREQUENCIES, self.sample_rate, 15,
+                           reconstruct=False, decimate=True)
+
+    # The rounded windows and the filter's roll off move every key a little,
+    # measured under 0.8% of the loudest key on this recording
+    self.assertEqual(decimated.shape, full.shape)
+    np.testing.assert_allclose(np.abs(decimated), np.abs(full),
+                               rtol=0, atol=0.01 * np.abs(full).max())
+
+
+class StreamTests(SimpleTestCase):
+
+  def test_matches_piano_pi(self):
+    file_path = os.path.join(os.path.dirname(__file__), '..', 'media', 'records', 'C4vH.wav')
+    expected = np.abs(PianoPi(file_path, uuid='stream', play_rate=15).key_freq_through_time_T)
+
+    source = WavSource(file_path)
+    stream = PianoPiStream(source.sample_rate, 15)
+    rng = np.random.default_rng(5)
+    frames, start = [], 0
+    while start < len(source):
+      stop = start + int(rng.integers(1, 2 * stream.bank.N_max))
+      frames.extend(stream.feed(source[start:stop]))
+      start = stop
+
+    # Only float rounding differs, measured around 3e-14 of the loudest key
+    self.assertEqual(stream.frames, len(expected))
+    np.testing.assert_allclose(frames, expected, rtol=0, atol=1e-12 * expected.max())
+
+
+class FrameFileTests(SimpleTestCase):
+
+  def test_round_trip(self):
+    rng = np.random.default_rng(3)
+    matrices = {
+      '<f4' : rng.random((2500, 5)).astype('<f4'),
+      '<c8' : (rng.random((7, 3)) + 1j * rng.random((7, 3))).astype('<c8'),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+      for dtype, matrix in matrices.items():
+        keys = np.arange(matrix.shape[1]) + 19
+        file_path = write_frames(os.path.join(directory, f'{dtype[1:]}.frames'),
+                                 matrix, 15, 48000, keys=keys, dtype=dtype)
+
+        header = read_header(file_path)
+        self.assertEqual((header['frames'], header['play_rate'], header['sample_rate']),
+                         (len(matrix), 15, 48000))
+        self.assertEqual(header['offset'] % 16, 0)
+        np.testing.assert_array_equal(header['keys'], keys)
+        for mmap in (False, True):
+          np.testing.assert_array_equal(read_frames(file_path, mmap=mmap)[1], matrix)
+
+  def test_tsv_rows(self):
+    rng = np.random.default_rng(4)
+    piano = PianoPi(None, uuid='tsv', play_rate=15, keys=range(19, 88))
+    piano.sample_rate = 48000
+    piano.audio_len = 3 * piano.sample_window
+    piano.key_freq_through_time_T = (rng.random((3, 69)) - 0.5) * 2e6
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+      os.chdir(directory)
+      try:
+        with open(piano.generate_tsv(), newline='') as f:
+          lines = f.readlines()
+      finally:
+        os.chdir(cwd)
+
+    self.assertEqual(lines[0], '#time_ms\t' + '\t'.join(map(str, range(19, 88))) + '\r\n')
+    percentages = piano.key_percentages()
+    for n, line in enumerate(lines[1:]):
+      self.assertEqual(line, '\t'.join([str(round(n * 1000 / 15))] +
+                                       ['{0:.2f}'.format(value) for value in percentages[n]]) + '\r\n')
+
+
+class ParseInputTests(SimpleTestCase):
+
+  def test_parses_tsv(self):
+    with tempfile.TemporaryDirectory() as directory:
+      file_path = os.path.join(directory, 'notes.tsv')
+      with open(file_path, 'w', newline='') as f:
+        f.write('#time_ms\t20\t19\r\n0\t5.00\t40.00\r\n67\t80.00\t0.00\r\n')
+      data = scheduler.parse_input(file_path, keys=[19, 20, 21])
+
+    # Time stamps kept, keys reordered by the header, 5% is silence and the
+    # loudest key is 1
+    np.testing.assert_allclose(data, [[0, 0.5, 0, 0], [67, 0, 1, 0]])
+
+
+class EventTests(SimpleTestCase):
+
+  def test_round_trip(self):
+    performance = np.zeros((5, 4))
+    performance[0, 1] = 0.5
+    performance[2, 1] = -1
+    performance[4, [0, 3]] = 1
+    keys = [19, 20, 30, 87]
+
+    encoded = events.encode(performance, keys)
+    np.testing.assert_array_equal(encoded, [[0, 20, events.PRESS, 64],
+                                            [2, 20, events.LIFT, 0],
+                                            [4, 19, events.PRESS, 127],
+                                            [4, 87, events.PRESS, 127]])
+
+    payload = events.to_payload(encoded, len(performance), 15, keys)
+    self.assertEqual(payload['events'][::4], [0, 2, 2, 0])
+    decoded, frames, _, payload_keys, levels = events.from_payload(payload)
+    np.testing.assert_allclose(events.decode(decoded, frames, payload_keys, levels),
+                               performance, atol=0.5 / events.VELOCITY_LEVELS)
+
+  def test_performance_events(self):
+    data = np.array([[0, 0.5, 0], [67, 0, 0], [133, 0, 0]])
+    played = []
+    scheduler.play_events(scheduler.performance_events(scheduler.data_to_performance(data),
+                                                       keys=[40, 41]),
+                          lambda *event: played.append(event))
+    self.assertEqual(played, [(0, 40, events.PRESS, 64 / 127), (1, 40, events.LIFT, 0)])
+
+
+class ResultCacheTests(SimpleTestCase):
+
+  def test_evict_skips_entries_being_written(self):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = ResultCache(directory, max_bytes=1500)
+      complete, writing = 'a' * 40, 'b' * 40
+      for key in (complete, writing):
+        os.makedirs(cache.path(key))
+        with open(os.path.join(cache.path(key), 'out'), 'wb') as f:
+          f.write(bytes(1000))
+      cache.write_refs(complete, ['1'])
+
+      # Over budget, but the entry without an entry file is still being filled
+      self.assertEqual(cache.evict(), [complete])
+      self.assertEqual(cache.keys(), [writing])
@@ -9,11 +9,17 @@ from . import scheduler_test
 
 from .PianoPi import piano_pi
 from .PianoPi import scheduler
+from .PianoPi import events
+from .PianoPi.result_cache import ResultCache
 
 #C:\Users\jwama\Desktop\Masters\Fall\Capstone\WebApp\talkingpiano\audio_ui\views.py
 
 from .models import Record
 
+# The scheduler reads PianoPi and the frame store directly, the tsv is only
+# written for people who want to download it
+EXPORT_TSV = False
+
 
 # Create your views here.
 def record(request):
@@ -42,7 +48,17 @@ def getArray(request):
     
     print("Generating piano note matrix")
     #if(pianoPiClass != 0):
-    noteArray = pianoPiClass.generate_piano_note_matrix()
+    # Memory map the saved analysis of the recording on the page, fall back
+    # on the last PianoPi built by record_detail
+    piano = None
+    if ResultCache.is_key(request.POST.get("uuid")):
+      piano = piano_pi.PianoPi.from_store(request.POST["uuid"])
+    if piano is None:
+      piano = pianoPiClass
+    # Sent as sparse events, see PianoPi/events.py, rather than the mostly
+    # empty dense matrix
+    payload = events.payload_matrix(piano.piano_note_matrix, piano.play_rate,
+                                    piano.keys)
     #noteArray = scheduler.init("/media/out/"+ tsvFileName +"/" + tsvFileName + ".tsv")
     #else:
     #  print("ERROR, PianoPi Class not set yet")
@@ -50,7 +66,7 @@ def getArray(request):
     print("Finished")
     return JsonResponse(
       {
-        "data":noteArray
+        "data":payload
       }
   )
 
@@ -62,15 +78,29 @@ def record_detail(request, fileName):
   global pianoPiClass
   global tsvFileName
   tsvFileName = fileName
-  pianoPiClass = piano_pi.PianoPi(file_path = 'C:/Users/jwama/Desktop/Masters/Fall/Capstone/WebApp/talkingpiano/media/records/' + fileName + '.wav', uuid=fileName, play_rate=15)
-  pianoPiClass.plot_freq_through_time()
-  pianoPiClass.generate_output_wav_file()
-  pianoPiClass.generate_piano_note_matrix()
-
-  print("Done creating PianoPi")
-  print("Creating TSV...")
-  pianoPiClass.generate_tsv()
-  print("TSV Made")
+  # Outputs live under media/out/<key>, key hashing the recording and the
+  # analysis parameters, so repeat views and duplicate uploads reuse them
+  cache = ResultCache()
+  key = piano_pi.cache_key(record.voice.path, play_rate=15, decimate=True,
+                           digest=record.voice_digest())
+  pianoPiClass = piano_pi.PianoPi.from_store(key) if cache.lookup(key) else None
+  if pianoPiClass is None:
+    # Decimated for speed, the page doesn't need to match a PianoPiStream
+    pianoPiClass = piano_pi.PianoPi(file_path = record.voice.path, uuid=key, play_rate=15,
+                                    decimate=True)
+    pianoPiClass.save_frames()
+    pianoPiClass.generate_output_wav_file()
+
+    print("Done creating PianoPi")
+    pianoPiClass.generate_frames()
+    if EXPORT_TSV:
+      print("Creating TSV...")
+      pianoPiClass.generate_tsv()
+      print("TSV Made")
+
+  # Drawn client side by heatmap.js, reuses the payloads of a cached result
+  pianoPiClass.generate_heatmaps()
+  cache.add(key, str(record.id))
   
 
   #noteArray = scheduler_test.identity_matrix()
@@ -79,7 +109,7 @@ def record_detail(request, fileName):
   context = {
     "page_title": "Details",
     "record": record,
-    "param" : fileName,
+    "param" : key,
   }
 
   return render(request, "audio_ui/record_detail.html", context)